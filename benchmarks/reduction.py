@@ -0,0 +1,62 @@
+"""Microbenchmark for slicing cropped frames, comparing the per-frame
+float reduction with the batched integer kernel, at the default ROI
+size and at full HD.
+
+    python -m benchmarks.reduction
+"""
+import timeit
+
+import click
+import numpy as np
+from src.config import ENV
+from src.core.resonator_pipeline import frames_to_slices
+
+SIZES = {
+    "roi": (int(ENV.H), int(ENV.W)),
+    "full_hd": (1080, 1920),
+}
+
+
+def float_reduction(block: np.ndarray) -> np.ndarray:
+    """Reduction as it was done before, one frame at a time in float64"""
+    return np.stack([frame.mean(axis=2).mean(axis=1) for frame in block])
+
+
+def bench_reduction(height: int, width: int, batch: int, repeat: int) -> dict:
+    """Time both reductions on one block of random frames, returning
+    the time per frame (ms) and the speedup of the kernel.
+    """
+    rng = np.random.default_rng(0)
+    block = rng.integers(0, 256, (batch, height, width, 3), dtype=np.uint8)
+    out = np.empty((batch, height))
+
+    # make sure both give the same answer before timing them
+    np.testing.assert_allclose(float_reduction(block), frames_to_slices(block))
+
+    t_float = min(
+        timeit.repeat(lambda: float_reduction(block), number=1, repeat=repeat)
+    )
+    t_kernel = min(
+        timeit.repeat(lambda: frames_to_slices(block, out=out), number=1, repeat=repeat)
+    )
+    return {
+        "float_ms": 1000 * t_float / batch,
+        "kernel_ms": 1000 * t_kernel / batch,
+        "speedup": t_float / t_kernel,
+    }
+
+
+@click.command()
+@click.option("-k", "batch", default=int(ENV.SLICE_BATCH), help="Frames per block")
+@click.option("-r", "repeat", default=5, help="Number of timing repeats")
+def main(batch, repeat):
+    for name, (height, width) in SIZES.items():
+        res = bench_reduction(height, width, batch, repeat)
+        print(
+            f"{name} ({width}x{height}): float {res['float_ms']:.3f} ms/frame, "
+            f"kernel {res['kernel_ms']:.3f} ms/frame, speedup {res['speedup']:.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
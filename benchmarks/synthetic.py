@@ -0,0 +1,178 @@
+"""Synthetic resonator videos for benchmarks. Writes an inlet folder
+with a video, the basis image it registers against and a spreadsheet
+of cell counts and sensor data covering it, the same as a real run:
+
+    python -m benchmarks.synthetic -o synthetic -n 5400 -p pulse
+
+The pipeline can be run on it with its own basis image and ROI (src.main
+always uses those from the .env file):
+
+    pipeline("synthetic", basis_image="synthetic/basis.jpg", dims=roi_dims(1920, 1080))
+
+The histogram is shifted by TIME_CORRECT seconds, so a video not well
+over that long leaves it with no data.
+"""
+import os
+
+import click
+import cv2
+import numpy as np
+import pandas as pd
+from src.config import ENV
+
+# Shape of the brightness of the resonator over the video, from 0 to 1
+PROFILES = {
+    "flat": lambda t: np.zeros_like(t),
+    "ramp": lambda t: t,
+    "pulse": lambda t: np.exp(-(((t - 0.25) / 0.08) ** 2))
+    + 0.6 * np.exp(-(((t - 0.75) / 0.08) ** 2)),
+    "sine": lambda t: 0.5 - 0.5 * np.cos(8 * np.pi * t),
+}
+
+# Brightness of the resonator with no cells, and the most cells add
+BASE_BRIGHTNESS = 60
+MAX_BRIGHTNESS = 120
+
+# Share of the video that is concentration, and when washing starts
+END_CONCENTRATION = 0.45
+START_WASHING = 0.55
+
+
+def make_inlet(
+    folder: str,
+    n_frames: int = 900,
+    width: int = 1920,
+    height: int = 1080,
+    fps: float = 30,
+    profile: str = "pulse",
+    rows: int = 20,
+    seed: int = 0,
+) -> dict:
+    """Write a total video, basis image and spreadsheet to folder and
+    return their paths, with the dims of the resonator in the video.
+    """
+    os.makedirs(folder, exist_ok=True)
+    dims = roi_dims(width, height)
+    texture = _texture(width, height, seed)
+
+    basis = f"{folder}{os.sep}basis.jpg"
+    cv2.imwrite(basis, _draw(texture, dims, BASE_BRIGHTNESS))
+
+    video = f"{folder}{os.sep}synthetic_total.mp4"
+    make_video(video, texture, dims, n_frames, fps, profile, seed)
+
+    xlsx = f"{folder}{os.sep}synthetic_sheet.xlsx"
+    make_sheet(xlsx, n_frames / fps, profile, rows, seed)
+    return {"video": video, "basis": basis, "xlsx": xlsx, "dims": dims}
+
+
+def roi_dims(width: int, height: int) -> dict:
+    """ROI from the .env file, scaled from 1920x1080 to the video"""
+    sx, sy = width / 1920, height / 1080
+    return {
+        "X": round(int(ENV.X) * sx),
+        "Y": round(int(ENV.Y) * sy),
+        "W": max(round(int(ENV.W) * sx), 1),
+        "H": max(round(int(ENV.H) * sy), 1),
+    }
+
+
+def make_video(
+    path: str,
+    texture: np.ndarray,
+    dims: dict,
+    n_frames: int,
+    fps: float,
+    profile: str,
+    seed: int = 0,
+):
+    """Write n_frames of texture with the resonator brightness following
+    profile, plus a little noise from frame to frame.
+    """
+    if profile not in PROFILES:
+        raise ValueError(f"Profile {profile} not one of {', '.join(PROFILES)}")
+    rng = np.random.default_rng(seed)
+    levels = BASE_BRIGHTNESS + MAX_BRIGHTNESS * PROFILES[profile](
+        np.linspace(0, 1, n_frames)
+    )
+    noise = rng.normal(0, 2, n_frames)
+
+    height, width = texture.shape[:2]
+    out = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+    for level, _noise in zip(levels, noise):
+        out.write(_draw(texture, dims, level + _noise))
+    out.release()
+
+
+def make_sheet(path: str, duration: float, profile: str, rows: int, seed: int = 0):
+    """Spreadsheet laid out as ReadExcel expects: concentration and
+    washing cell counts and sensor data, with times in minutes, and
+    the reference times (min:sec) of each stage in the video.
+    """
+    rng = np.random.default_rng(seed)
+    end_conc, start_wash = END_CONCENTRATION * duration, START_WASHING * duration
+
+    def _stage(start, stop):
+        t = np.linspace(start, stop, rows)
+        cells = PROFILES[profile](t / duration) + rng.normal(0, 0.02, rows)
+        sensor = 125 + 10 * cells + rng.normal(0, 0.5, rows)
+        t = (t - start) / 60
+        return np.stack((t, cells, t, sensor), axis=1)
+
+    reference = [
+        ("Start of concentration", _min_sec(0)),
+        ("End of concentration", _min_sec(end_conc)),
+        ("Start of washing", _min_sec(start_wash)),
+        ("End of washing", "End of video"),
+    ]
+
+    sheet = np.full((rows + 2, 14), None, dtype=object)
+    sheet[0, [0, 6, 13]] = ("Concentration", "Washing", "Video timer (min:sec)")
+    header = ("Time (min)", "Cell Count (million cells/mL)", "Time (min)", "Sensor")
+    sheet[1, 0:4] = sheet[1, 6:10] = header
+    sheet[2:, 0:4] = _stage(0, end_conc)
+    sheet[2:, 6:10] = _stage(start_wash, duration)
+    sheet[1 : len(reference) + 1, 12:14] = reference
+    pd.DataFrame(sheet).to_excel(path, header=False, index=False, sheet_name="Data")
+
+
+def _texture(width: int, height: int, seed: int) -> np.ndarray:
+    """Blurred noise, with enough corners for ORB to register against"""
+    rng = np.random.default_rng(seed)
+    small = rng.integers(0, 256, (height // 8, width // 8, 3), dtype=np.uint8)
+    texture = cv2.resize(small, (width, height), interpolation=cv2.INTER_LINEAR)
+    return cv2.GaussianBlur(texture, (5, 5), 2)
+
+
+def _draw(texture: np.ndarray, dims: dict, level: float) -> np.ndarray:
+    frame = texture.copy()
+    x, y, w, h = dims["X"], dims["Y"], dims["W"], dims["H"]
+    frame[y : y + h, x : x + w] = np.uint8(np.clip(level, 0, 255))
+    return frame
+
+
+def _min_sec(seconds: float) -> str:
+    return f"{int(seconds // 60)}:{seconds % 60:05.2f}"
+
+
+@click.command()
+@click.option("-o", "folder", default="synthetic", help="Folder to write to")
+@click.option("-n", "n_frames", default=900, help="Number of frames")
+@click.option("-w", "width", default=1920, help="Width of the video")
+@click.option("-h", "height", default=1080, help="Height of the video")
+@click.option("--fps", "fps", default=30.0, help="Frame rate of the video")
+@click.option(
+    "-p",
+    "profile",
+    type=click.Choice(list(PROFILES)),
+    default="pulse",
+    help="Shape of the brightness of the resonator over the video",
+)
+@click.option("-r", "rows", default=20, help="Rows of data in each column")
+def main(folder, n_frames, width, height, fps, profile, rows):
+    paths = make_inlet(folder, n_frames, width, height, fps, profile, rows)
+    print(f"Wrote {paths['video']} with the resonator at {paths['dims']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+"""Throughput of each stage of the pipeline on a synthetic video: frames
+per second and peak memory of slicing (ResonatorPipeline.run), reading
+the spreadsheet (ReadExcel), splitting a total video, the histogram
+stage (HistogramPipeline with its plot) and the live loop (replayed as
+fast as possible). Results are written as JSON, to compare between
+commits or machines.
+
+    python -m benchmarks.throughput -n 900 -o throughput.json
+
+Peak memory is measured with tracemalloc in a second run of each stage,
+so the timings aren't slowed by it. It counts what is allocated by
+python and numpy in this process, not by OpenCV internally or by
+worker processes.
+"""
+import contextlib
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import click
+import cv2
+import numpy as np
+from src.api.live import analyze_live_video
+from src.api.sinks import CallbackSink
+from src.config import ENV
+from src.core.histogram_pipeline import HistogramPipeline
+from src.core.read_excel import ReadExcel
+from src.core.resonator_pipeline import ResonatorPipeline
+from src.core.results_io import FORMATS
+from src.run.process import process_config
+from src.run.splitting import total_sliced_splitter
+from src.run.utils import get_background
+
+from .synthetic import PROFILES, make_inlet
+
+
+def measure(stage, memory: bool = True) -> dict:
+    """Time stage(), then run it again under tracemalloc for its peak
+    memory. stage returns the number of frames (or rows) it handled.
+    """
+    start = time.perf_counter()
+    items = stage()
+    seconds = time.perf_counter() - start
+    result = {"items": items, "seconds": seconds, "per_s": items / seconds}
+
+    if memory:
+        tracemalloc.start()
+        try:
+            stage()
+            result["peak_mb"] = tracemalloc.get_traced_memory()[1] / 2**20
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def bench_pipeline(
+    paths: dict,
+    work: str,
+    jobs: int,
+    results_format: str,
+    save_video: bool,
+    memory: bool,
+) -> dict:
+    """Run each stage on the synthetic inlet, with the output of each
+    stage feeding the next as in the pipeline.
+    """
+    n_frames = int(cv2.VideoCapture(paths["video"]).get(cv2.CAP_PROP_FRAME_COUNT))
+    out = {}
+
+    def _resonator():
+        rp = ResonatorPipeline(
+            paths["video"],
+            paths["basis"],
+            out_folder=f"{work}{os.sep}results",
+            dims=paths["dims"],
+            jobs=jobs,
+            cache_dir=None,
+            checkpoint_every=0,
+        )
+        out["sliced"] = rp.run(ENV.CROPPED_FILENAME if save_video else None)
+        return n_frames
+
+    def _read_excel():
+        out["xlsx"] = ReadExcel(paths["xlsx"]).run()
+        return sum(len(v) for k, v in out["xlsx"].items() if k != "reference_data")
+
+    def _split():
+        data_items, out["wash_start"] = process_config(os.path.dirname(paths["video"]))
+        data = data_items["total"]
+        out["parts"] = total_sliced_splitter(data, out["sliced"], ENV.SLICED_FILENAME)
+        out["data"] = data["data"]
+        return n_frames
+
+    def _histogram():
+        frames = 0
+        for title, path in out["parts"].items():
+            htp = HistogramPipeline(
+                path,
+                # times are converted in place, so each run needs a copy
+                {k: v.copy() for k, v in out["data"][title].items()},
+                out_folder=f"{work}{os.sep}results",
+                t_correct=0,
+                s_per_frame=1 / _fps(paths["video"]),
+                vid_start=out["wash_start"] if title == "washing" else 0.0,
+                background=get_background(path),
+                results_format=results_format,
+            )
+            htp.plot(
+                title=title,
+                save=True,
+                filename=f"{title}_{ENV.HIST_PLOT}",
+                headless=True,
+            )
+            frames += len(htp.brightness_raw) * int(ENV.SLICE_FREQ)
+        return frames
+
+    def _live():
+        analyze_live_video(
+            paths["video"],
+            f"{work}{os.sep}live.mp4",
+            buffer=int(ENV.SLICE_FREQ),
+            sinks=[CallbackSink(lambda records: None)],
+            preview_fps=0,
+            dims=paths["dims"],
+            record="none",
+            reregister_s=0,
+            replay_speed=0,
+        )
+        return n_frames
+
+    stages = {
+        "resonator": (_resonator, "frames"),
+        "read_excel": (_read_excel, "rows"),
+        "split_total": (_split, "frames"),
+        "histogram": (_histogram, "frames"),
+        "live": (_live, "frames"),
+    }
+    for name, (stage, unit) in stages.items():
+        print(f"Benchmarking {name}...", file=sys.stderr)
+        out[name] = dict(measure(stage, memory), unit=unit)
+    return {name: out[name] for name in stages}
+
+
+def _fps(video: str) -> float:
+    cap = cv2.VideoCapture(video)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    cap.release()
+    return fps
+
+
+def _environment() -> dict:
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpus": os.cpu_count(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+    }
+
+
+@click.command()
+@click.option("-n", "n_frames", default=900, help="Frames in the synthetic video")
+@click.option("-w", "width", default=1920, help="Width of the video")
+@click.option("-h", "height", default=1080, help="Height of the video")
+@click.option("--fps", "fps", default=30.0, help="Frame rate of the video")
+@click.option(
+    "-p",
+    "profile",
+    type=click.Choice(list(PROFILES)),
+    default="pulse",
+    help="Shape of the brightness of the resonator over the video",
+)
+@click.option("-j", "jobs", default=1, help="Processes used to slice the video")
+@click.option(
+    "-f",
+    "results_format",
+    type=click.Choice(list(FORMATS)),
+    default=ENV.RESULTS_FORMAT,
+    help="Format to save results in",
+)
+@click.option("--video/--no-video", "save_video", default=True, help="Save cropped")
+@click.option("--memory/--no-memory", default=True, help="Also measure peak memory")
+@click.option("-o", "output", default=None, help="JSON file to write, or stdout")
+def main(
+    n_frames,
+    width,
+    height,
+    fps,
+    profile,
+    jobs,
+    results_format,
+    save_video,
+    memory,
+    output,
+):
+    work = tempfile.mkdtemp(prefix="bench_")
+    try:
+        print("Writing synthetic video...", file=sys.stderr)
+        paths = make_inlet(
+            f"{work}{os.sep}inlet", n_frames, width, height, fps, profile
+        )
+        # progress printed by the pipeline goes to stderr, so that the
+        # results can be piped from stdout
+        with contextlib.redirect_stdout(sys.stderr):
+            stages = bench_pipeline(
+                paths, work, jobs, results_format, save_video, memory
+            )
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+    result = {
+        "video": {
+            "frames": n_frames,
+            "width": width,
+            "height": height,
+            "fps": fps,
+            "profile": profile,
+        },
+        "settings": {
+            "jobs": jobs,
+            "results_format": results_format,
+            "save_video": save_video,
+        },
+        "environment": _environment(),
+        "stages": stages,
+    }
+    for name, res in stages.items():
+        peak = f", peak {res['peak_mb']:.1f} MB" if "peak_mb" in res else ""
+        print(
+            f"{name}: {res['per_s']:.1f} {res['unit']}/s ({res['seconds']:.2f} s){peak}",
+            file=sys.stderr,
+        )
+
+    if output is None:
+        print(json.dumps(result, indent=2))
+    else:
+        with open(output, "w") as fp:
+            json.dump(result, fp, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+import json
+import os
+import re
+
+import click
+import numpy as np
+import pandas as pd
+from src.api.smoothing import divergence
+from src.config import ENV
+from src.core.results_io import load_results
+
+
+def read_live_log(path: str) -> dict:
+    """Read live results back into arrays, one per field (t, t_smooth,
+    smooth_bri, smooth_loss, raw_bri, cell_loss). path is a .csv or
+    .ndjson file written by a FileSink, or the lines printed by the live
+    analyzer, in which lines that aren't results are skipped.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".csv":
+        rows = pd.read_csv(path).to_dict("records")
+    elif ext in (".ndjson", ".jsonl", ".json"):
+        with open(path, "r") as fp:
+            rows = [json.loads(line) for line in fp if line.strip()]
+    else:
+        rows = []
+        with open(path, "r") as fp:
+            for line in fp:
+                fields = dict(re.findall(r"(\w+)=(-?[\d.]+)", line))
+                if "t" in fields and "cell_loss" in fields:
+                    rows.append(fields)
+    if not rows:
+        raise Exception(f"No live results in {path}")
+    return {k: np.array([float(r.get(k, np.nan)) for r in rows]) for k in rows[0]}
+
+
+def compare_live(live_log: str, results: str, t_correct: float) -> dict:
+    """Divergence of the smoothed live cell loss from the offline results
+    of the recording of the same session. Offline times are in minutes
+    and include t_correct, live times are seconds from the start.
+    """
+    live = read_live_log(live_log)
+    df = load_results(results)
+    offline_t = df["Time (min) - imaging"].values * 60 - t_correct
+    offline = (offline_t, df["Image analysis (Estimated Cell Loss)"].values)
+    return {
+        "smoothed": divergence((live["t_smooth"], live["smooth_loss"]), offline),
+        "raw": divergence((live["t"], live["cell_loss"]), offline),
+    }
+
+
+@click.command()
+@click.option(
+    "-l",
+    "live_log",
+    help="Output of the live analyzer saved to a file, or its .ndjson/.csv sink",
+)
+@click.option("-r", "results", help="Results data from the pipeline for the video")
+@click.option(
+    "-t",
+    "t_correct",
+    default=float(ENV.TIME_CORRECT),
+    help="TIME_CORRECT used for the results data",
+)
+def main(live_log, results, t_correct):
+    for name, stats in compare_live(live_log, results, t_correct).items():
+        print(f"{name}: " + ", ".join(f"{k}={v:.4g}" for k, v in stats.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+import sys
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+from src.config import ENV
+from src.core.resonator_pipeline import (
+    find_homography,
+    match_features,
+    norm_image,
+    orb_features,
+)
+from src.extra.queues import QueueWorker
+
+
+class DriftTracker:
+    """Follows the resonator if the camera moves during a live session.
+    The first frame given is the basis; every every_s seconds another
+    frame is registered against it in a background thread, the same way
+    as ResonatorPipeline registers videos, and the ROI is moved to
+    where the registration puts it when that is more than threshold
+    pixels from the current one. Only one frame waits at a time, if
+    registration is still running the frame is skipped, so capture is
+    never held up. The new ROI is swapped into config by apply, from
+    the capture loop, between two frames.
+
+    Args:
+        every_s: seconds between registrations, 0 to turn off
+        threshold: pixels the ROI must move by before it is updated
+    """
+
+    name = "drift"
+
+    def __init__(
+        self,
+        every_s: float = float(ENV.REREGISTER_S),
+        threshold: float = float(ENV.REREGISTER_PX),
+    ):
+        self.period = every_s * 1000
+        self.threshold = threshold
+        self.roi = None
+        self.corrections = 0
+        self.failed = 0
+        self.shift = 0
+        self._basis = None
+        self._basis_roi = None
+        self._applied = None
+        self._last = None
+        self._worker = None
+        if every_s > 0:
+            self._worker = QueueWorker(self._register, 1, "newest", "Registration")
+
+    def put(self, frame: np.ndarray, config: dict, now: float) -> bool:
+        """Register frame if every_s seconds have passed since the last
+        one (now is in milliseconds), returns True if it was queued.
+        """
+        if self._worker is None:
+            return False
+        if self._last is not None and now - self._last < self.period:
+            return False
+
+        self._last = now
+        if self._basis_roi is None:
+            self._basis_roi = _config_roi(config)
+            self.roi = self._applied = self._basis_roi
+        return self._worker.put(frame)
+
+    def apply(self, config: dict) -> bool:
+        """Move the ROI in config if registration has found a new one"""
+        roi = self.roi
+        if roi is self._applied:
+            return False
+        config["X"], config["Y"], config["W"], config["H"] = roi
+        self._applied = roi
+        return True
+
+    def stats(self) -> dict:
+        if self._worker is None:
+            return {"every_s": 0}
+        return {
+            **self._worker.stats(),
+            "corrections": self.corrections,
+            "failed": self.failed,
+            "shift": self.shift,
+        }
+
+    def close(self):
+        if self._worker is not None:
+            self._worker.close()
+
+    def _register(self, frame: np.ndarray):
+        features = orb_features(norm_image(frame))
+        if self._basis is None:
+            self._basis = features
+            return
+
+        matches = match_features(self._basis, features)
+        homography = find_homography(self._basis, features, matches)
+        roi = None if homography is None else warp_roi(homography, self._basis_roi)
+        if roi is None or not _inside(roi, frame.shape):
+            self.failed += 1
+            return
+
+        current = self.roi
+        self.shift = max(abs(a - b) for a, b in zip(roi, current))
+        if self.shift > self.threshold:
+            self.roi = roi
+            self.corrections += 1
+            print(
+                f"Camera moved by {self.shift}px, ROI is now "
+                f"X={roi[0]} Y={roi[1]} W={roi[2]} H={roi[3]}",
+                file=sys.stderr,
+            )
+
+
+def warp_roi(
+    homography: np.ndarray, roi: Tuple[int, int, int, int]
+) -> Optional[Tuple[int, int, int, int]]:
+    """Bounding box (X, Y, W, H) of the ROI once its corners are moved
+    by homography, or None if it is degenerate.
+    """
+    x, y, w, h = roi
+    corners = np.float32([[x, y], [x + w, y], [x, y + h], [x + w, y + h]])
+    warped = cv2.perspectiveTransform(corners.reshape(-1, 1, 2), homography)
+    left, top = np.round(warped.min(axis=(0, 1))).astype(int)
+    right, bottom = np.round(warped.max(axis=(0, 1))).astype(int)
+    if right <= left or bottom <= top:
+        return None
+    return int(left), int(top), int(right - left), int(bottom - top)
+
+
+def _inside(roi: Tuple[int, int, int, int], shape: tuple) -> bool:
+    x, y, w, h = roi
+    return x >= 0 and y >= 0 and x + w <= shape[1] and y + h <= shape[0]
+
+
+def _config_roi(config: dict) -> Tuple[int, int, int, int]:
+    return tuple(int(config[k]) for k in ("X", "Y", "W", "H"))
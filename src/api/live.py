@@ -1,12 +1,20 @@
 import datetime
+import os
+import signal
+import sys
 import threading
 import time
-from typing import Optional, Tuple
+from typing import List, Optional, Tuple
 
 import cv2
 import numpy as np
+from src.api.drift import DriftTracker
+from src.api.recorder import Recorder
+from src.api.replay import ReplayCapture
+from src.api.sinks import Sink, StdoutSink
+from src.api.smoothing import CausalGaussian, live_sigma
 from src.config import ENV
-from src.core.resonator_pipeline import frame_to_slice
+from src.extra.queues import QueueWorker
 from src.extra.reset_coords import BoundingBoxWidget
 
 # HARD DEFINE CONSTANTS TO BE USED FOR GOPRO CAMERA
@@ -15,6 +23,12 @@ GOPRO_FPS = 30
 GOPRO_WIDTH = 1920
 GOPRO_HEIGHT = 1080
 
+# Seconds between reports of queue depth and dropped frames
+STATS_EVERY = 30
+
+# Seconds between checks for the stop file
+STOP_CHECK_EVERY = 1
+
 
 def analyze_live_video(
     input_source: Optional[str],
@@ -22,72 +36,227 @@ def analyze_live_video(
     calibrate: bool = False,
     buffer: int = 1,
     debug: bool = False,
+    lag: float = float(ENV.LIVE_LAG),
+    sinks: List[Sink] = None,
+    preview_fps: float = float(ENV.PREVIEW_FPS),
+    preview_width: int = int(ENV.PREVIEW_WIDTH),
+    stop_file: Optional[str] = None,
+    dims: dict = None,
+    record: str = ENV.RECORD_MODE,
+    segment_s: float = float(ENV.RECORD_SEGMENT_S),
+    segment_mb: float = float(ENV.RECORD_SEGMENT_MB),
+    reregister_s: float = float(ENV.REREGISTER_S),
+    reregister_px: float = float(ENV.REREGISTER_PX),
+    replay_speed: Optional[float] = None,
 ):
     """High-level function for analyzing live video feed. Calls main
-    loop, until keyboard exit is pressed, then destroys windows and
-    releases video cap.
+    loop until keyboard exit is pressed, SIGTERM is received or
+    stop_file is created, then destroys windows and releases video cap.
+
+    Args:
+        input_source: camera or video to read, a video file with replay_speed
+        output_file: file to record the session to
+        calibrate: select the ROI on the first frame before starting
+        buffer: number of frames in each reported value
+        debug: read the frame rate from the video instead of the GoPro's
+        lag: seconds late the smoothed estimate is reported
+        sinks: where results go, by default printed to stdout
+        preview_fps: times a second the preview is redrawn, 0 for none
+        preview_width: width of the preview in pixels
+        stop_file: file that stops the session when it is created
+        dims: ROI coordinates replacing those from the .env file
+        record: full, roi, downscaled or none (no recording)
+        segment_s: seconds of video in each recorded segment
+        segment_mb: size of each recorded segment in MB
+        reregister_s: seconds between checks for camera movement
+        reregister_px: pixels the ROI must move by before it is updated
+        replay_speed: multiple of real time to replay input_source at
+            (0 for as fast as possible), with times taken from the video
     """
 
     # Get config
     config = _get_config()
+    config.update(dims or {})
+    config["PREVIEW_FPS"], config["PREVIEW_WIDTH"] = preview_fps, preview_width
+    config["STOP_FILE"] = stop_file
+    headless = preview_fps <= 0
 
     # Calibrate ROI if necessary
     if calibrate:
+        if headless:
+            raise Exception("Calibrating the ROI needs a display, use --nocal")
         config = _calibrate(input_source, config)
 
+    # A stop file left over from an earlier session would stop this one
+    if stop_file is not None and os.path.exists(stop_file):
+        os.remove(stop_file)
+
     # Create vidcap object with input source
-    vidcap = cv2.VideoCapture(input_source)
+    replay = replay_speed is not None
+    if replay:
+        vidcap = ReplayCapture(input_source, replay_speed)
+        clock = vidcap.clock
+        # a replay has its own frame rate, as in a debug session
+        debug = True
+    else:
+        vidcap = cv2.VideoCapture(input_source)
+        clock = _current_milli_time
 
-    # Create object to write output to
-    outwriter = _init_vidwriter(vidcap, output_file, debug)
+    # Create encoder process to record to
+    recorder = _init_recorder(vidcap, output_file, debug, record, segment_s, segment_mb)
 
-    # Release the video camera when interrupted
+    # Smooth the same amount as offline, converted to buffers
+    smoother = _init_smoother(vidcap, config, buffer, lag, debug)
+
+    # Follow the resonator if the camera is moved
+    drift = DriftTracker(reregister_s, reregister_px)
+
+    # Where to send results
+    if sinks is None:
+        sinks = [StdoutSink()]
+
+    # Release the video camera when interrupted or stopped
+    stop = threading.Event()
+    previous = _stop_on_sigterm(stop)
     try:
-        _main_loop(vidcap, outwriter, config, buffer)
+        _main_loop(
+            vidcap, recorder, config, buffer, smoother, sinks, stop, drift, clock
+        )
     except KeyboardInterrupt:
-        cv2.destroyAllWindows()
+        pass
+    finally:
+        if previous is not None:
+            signal.signal(signal.SIGTERM, previous)
+        if not headless:
+            cv2.destroyAllWindows()
+        if replay:
+            vidcap.report()
         vidcap.release()
-        outwriter.release()
 
 
 def _main_loop(
     vidcap: cv2.VideoCapture,
-    outwriter: cv2.VideoWriter,
+    recorder: Recorder,
     config: dict,
     buffer: int,
+    smoother: CausalGaussian,
+    sinks: List[Sink],
+    stop: threading.Event = None,
+    drift: DriftTracker = None,
+    clock=None,
 ):
-    """Read frames from video, calculate brightness
-    and add to buffer. When buffer is full, report
-    brightness to stdout.
+    """Read frames from video, calculate brightness and add to buffer.
+    When buffer is full, report brightness to the sinks. Runs until
+    stop is set, the stop file in config exists or a replay ends.
+
+    Args:
+        vidcap: camera or ReplayCapture to read frames from
+        recorder: encoder process each frame is recorded by
+        config: ROI coordinates and settings, moved by drift
+        buffer: number of frames in each reported value
+        smoother: smoothed estimate of the brightness
+        sinks: where results go
+        stop: set to end the loop
+        drift: follows the resonator if the camera moves
+        clock: time (ms) each buffer's t is measured on
     """
+    stop = threading.Event() if stop is None else stop
+    drift = DriftTracker(0) if drift is None else drift
+    clock = _current_milli_time if clock is None else clock
 
     # Get time at start of loop
-    start = _current_milli_time()
+    start = clock()
+
+    # video is recorded in another process, brightness reported in a thread
+    size, policy = int(config["LIVE_QUEUE_SIZE"]), config["LIVE_DROP"]
+    workers = {
+        "recorder": recorder,
+        "drift": drift,
+        "analysis": QueueWorker(
+            lambda item: _report_brightness(*item, config, start, smoother, sinks),
+            size,
+            policy,
+            "DisplayData",
+        ),
+    }
+    # sinks come last, so they are closed after the analysis is finished
+    workers.update({f"{sink.name}_{i}": sink for i, sink in enumerate(sinks)})
+
+    # running sum of the brightness window over the buffer
+    window_sum, window_size, n_frames = 0.0, 0, 0
+    frame_index = -1
+
+    # the preview is only redrawn every preview_period milliseconds
+    fps = float(config["PREVIEW_FPS"])
+    preview_period = 1000 / fps if fps > 0 else float("inf")
+    last_preview = last_check = last_stats = _current_milli_time()
+    try:
+        while not stop.is_set():
+            _success, frame = vidcap.read()
+            if _success:
+                drift.apply(config)
+                _sum, _size = _window_sum(frame, config)
+                window_sum, window_size = window_sum + _sum, window_size + _size
+                n_frames += 1
+                frame_index += 1
+
+                # display downscaled video, throttled
+                if _current_milli_time() - last_preview >= preview_period:
+                    last_preview = _current_milli_time()
+                    _display_frame(_preview(frame, int(config["PREVIEW_WIDTH"])))
+
+                recorder.put(frame, config)
+                drift.put(frame, config, clock())
+
+                if n_frames == buffer:
+                    brightness = window_sum / window_size
+                    captured, wall = clock(), _current_milli_time()
+                    workers["analysis"].put((brightness, captured, wall, frame_index))
+                    window_sum, window_size, n_frames = 0.0, 0, 0
+            elif isinstance(vidcap, ReplayCapture) and vidcap.finished:
+                stop.set()
+
+            if _current_milli_time() - last_check > STOP_CHECK_EVERY * 1000:
+                last_check = _current_milli_time()
+                if config["STOP_FILE"] and os.path.exists(config["STOP_FILE"]):
+                    stop.set()
+
+            if _current_milli_time() - last_stats > STATS_EVERY * 1000:
+                last_stats = _current_milli_time()
+                _report_stats(workers)
+    finally:
+        for worker in workers.values():
+            worker.close()
+        _report_stats(workers)
+
+
+def _report_stats(workers: dict):
+    """Queue depth and dropped items of each worker, to stderr so
+    that the results on stdout are unchanged.
+    """
+    stats = "; ".join(
+        f"{name}: " + ", ".join(f"{k}={v}" for k, v in worker.stats().items())
+        for name, worker in workers.items()
+    )
+    print(stats, file=sys.stderr)
 
-    frame_buffer = []
-    while True:
-        _success, frame = vidcap.read()
-        if _success:
-            frame_buffer.append(frame)
-
-            # display video
-            _display_frame(frame.copy())
-
-            # having video writing and imshow in the same thread caused errors
-            vidwrite_thread = threading.Thread(
-                target=_vid_thread, name="VidWriter", args=(outwriter, frame.copy())
-            )
-            vidwrite_thread.start()
-
-            if len(frame_buffer) == buffer:
-                # same logic as with video writer thread, added to avoid errors
-                buffer_thread = threading.Thread(
-                    target=_clear_framebuffer,
-                    name="DisplayData",
-                    args=(frame_buffer.copy(), config, start),
-                )
-                buffer_thread.start()
-                frame_buffer.clear()
+
+def _stop_on_sigterm(stop: threading.Event):
+    """Set stop on SIGTERM (e.g. from kill or a service manager) so that
+    the session ends cleanly, returns the previous handler. Handlers can
+    only be set from the main thread, otherwise nothing is done.
+    """
+    if threading.current_thread() is not threading.main_thread():
+        return None
+    return signal.signal(signal.SIGTERM, lambda *_: stop.set())
+
+
+def _preview(frame: np.ndarray, width: int) -> np.ndarray:
+    """Frame shrunk to width pixels wide for display"""
+    if width <= 0 or width >= frame.shape[1]:
+        return frame
+    height = round(frame.shape[0] * width / frame.shape[1])
+    return cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
 
 
 def _display_frame(frame):
@@ -97,56 +266,79 @@ def _display_frame(frame):
         raise KeyboardInterrupt()
 
 
-def _vid_thread(outwriter: cv2.VideoWriter, frame: np.ndarray):
-    """Write frame to videowriter object in separate thread"""
-    outwriter.write(frame)
-
-
-def _clear_framebuffer(frame_buffer: list, config: dict, start: float):
-    """Process frame buffer in separate thread"""
-    _now = (_current_milli_time() - start) / 1000
-    raw, cell = _get_data(frame_buffer, config)
-    print(
-        f"t={_now:.3f}, raw_bri={raw:.3f}, cell_loss={cell:.3f}",
-    )
+def _report_brightness(
+    brightness: float,
+    captured: float,
+    wall: float,
+    frame: int,
+    config: dict,
+    start: float,
+    smoother: CausalGaussian,
+    sinks: List[Sink],
+):
+    """Report brightness of a buffer in separate thread, the time
+    reported is when the last frame (index frame) was captured: t from
+    clock (captured), which is the video during a replay, and time from
+    the wall clock (wall), both in milliseconds.
+    """
+    _now = (captured - start) / 1000
+    raw = brightness - float(config["BRIGHTNESS"])
+    smooth = smoother.update(raw)
+    record = {
+        "time": wall / 1000,
+        "frame": frame,
+        "t": _now,
+        "t_smooth": _now - float(config["SMOOTH_LAG"]),
+        "smooth_bri": smooth,
+        "smooth_loss": _cell_loss(smooth, config),
+        "raw_bri": raw,
+        "cell_loss": _cell_loss(raw, config),
+    }
+    for sink in sinks:
+        sink.emit(record)
+
+
+def _init_smoother(
+    vidcap: cv2.VideoCapture, config: dict, buffer: int, lag: float, debug: bool
+) -> CausalGaussian:
+    """Causal gaussian with the same smoothing as the offline results,
+    lagging by lag seconds (at most the radius of the gaussian). The
+    actual lag in seconds is kept in config.
+    """
+    fps = vidcap.get(cv2.CAP_PROP_FPS) if debug else GOPRO_FPS
+    period = buffer / fps
+    sigma = live_sigma(int(config["GAUSS_STD"]), int(config["SLICE_FREQ"]), buffer)
+    smoother = CausalGaussian(sigma, round(lag / period))
+    config["SMOOTH_LAG"] = smoother.lag * period
+    print(f"Smoothed values are {config['SMOOTH_LAG']:.1f}s behind")
+    return smoother
 
 
-def _init_vidwriter(
-    vidcap: cv2.VideoCapture, output_file: str, debug: bool
-) -> cv2.VideoWriter:
-    """Create object to write to video output using properties
-    from video input.
+def _init_recorder(
+    vidcap: cv2.VideoCapture,
+    output_file: str,
+    debug: bool,
+    record: str,
+    segment_s: float,
+    segment_mb: float,
+) -> Recorder:
+    """Create encoder process to record the session, using the frame
+    rate of the input. The size of the recording is taken from the
+    frames themselves.
     """
     _output_file = _clean_filename(output_file)
 
-    fourcc = cv2.VideoWriter_fourcc(*"mp4v")
-
     # debug session is supposed to be on non-GoPro camera
-    if debug:
-        fps = vidcap.get(cv2.CAP_PROP_FPS)
-        width = int(vidcap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        height = int(vidcap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    else:
-        fps = GOPRO_FPS
-        width = GOPRO_WIDTH
-        height = GOPRO_HEIGHT
-
-    return cv2.VideoWriter(
-        _output_file,
-        fourcc,
-        fps,
-        (width, height),
+    fps = vidcap.get(cv2.CAP_PROP_FPS) if debug else GOPRO_FPS
+
+    return Recorder(
+        _output_file, fps, record, segment_s=segment_s, segment_mb=segment_mb
     )
 
 
-def _get_data(frame_buffer: list, config: dict) -> Tuple[float, float]:
-    """Calculate brightness and estimated cell count
-    from buffer of frames.
-    """
-    _frame_mean = np.mean(np.stack(frame_buffer, axis=-1), axis=-1)
-    raw = _get_brightness(_frame_mean, config) - float(config["BRIGHTNESS"])
-    cell = raw * float(config["ALPHA_BRI"]) + float(config["BETA_BRI"])
-    return raw, cell
+def _cell_loss(raw: float, config: dict) -> float:
+    """Estimated cell loss from brightness, using calibration"""
+    return raw * float(config["ALPHA_BRI"]) + float(config["BETA_BRI"])
 
 
 def _calibrate(input_source: Optional[str], config: dict) -> dict:
@@ -179,14 +371,22 @@ def _reset_basis(input_image: np.ndarray):
 
 def _get_brightness(input_image: np.ndarray, config: Tuple):
     """Calculate brightness of ROI"""
-    crop_frame = input_image[
-        int(config["Y"]) : int(config["Y"]) + int(config["H"]),
-        int(config["X"]) : int(config["X"]) + int(config["W"]),
-        :,
-    ]
-    _slice = frame_to_slice(crop_frame)
-    top, bottom = int(config["WIN_TOP"]), int(config["WIN_BOTTOM"])
-    return np.mean(_slice[top:bottom])
+    _sum, _size = _window_sum(input_image, config)
+    return _sum / _size
+
+
+def _window_sum(frame: np.ndarray, config: dict) -> Tuple[float, int]:
+    """Sum and number of values in rows WIN_TOP to WIN_BOTTOM of the
+    ROI. Brightness is the mean of these, the same as the mean of the
+    window rows of frame_to_slice on the cropped frame, but only the
+    window is read and no copy of it is made.
+    """
+    y, h = int(config["Y"]), int(config["H"])
+    x, w = int(config["X"]), int(config["W"])
+    top = y + min(int(config["WIN_TOP"]), h)
+    bottom = y + min(int(config["WIN_BOTTOM"]), h)
+    window = frame[top:bottom, x : x + w]
+    return sum(cv2.sumElems(window)), window.size
 
 
 def _current_milli_time():
@@ -0,0 +1,195 @@
+import multiprocessing as mp
+import os
+import queue
+import sys
+
+import cv2
+import numpy as np
+from src.config import ENV
+
+MODES = ("full", "roi", "downscaled", "none")
+
+# Frames between checks of the size of the segment on disk
+SIZE_CHECK_EVERY = 30
+
+# Seconds to wait for the encoder to take the last frame when closing
+CLOSE_TIMEOUT = 10
+
+
+class Recorder:
+    """Records a live session in a separate encoder process, so that
+    encoding never holds up analysis. Frames go through a bounded queue;
+    if the encoder falls behind, new frames are dropped (and counted)
+    rather than making capture wait. Only the ROI (roi) or a smaller
+    copy of each frame (downscaled) can be recorded to save disk and
+    CPU, and the recording can be split into segments of segment_s
+    seconds or segment_mb MB, so a crash only loses the last segment.
+
+    Args:
+        path: file to record to, segments are numbered path_000.mp4...
+        fps: frame rate of the recording
+        mode: full, roi, downscaled or none (no recording)
+        height: height of the frames recorded when downscaled
+        segment_s: seconds of video in each segment, 0 for no limit
+        segment_mb: size of each segment in MB, 0 for no limit
+        maxsize: number of frames that can wait to be encoded
+    """
+
+    name = "recorder"
+
+    def __init__(
+        self,
+        path: str,
+        fps: float,
+        mode: str = ENV.RECORD_MODE,
+        height: int = int(ENV.RECORD_HEIGHT),
+        segment_s: float = float(ENV.RECORD_SEGMENT_S),
+        segment_mb: float = float(ENV.RECORD_SEGMENT_MB),
+        maxsize: int = int(ENV.LIVE_QUEUE_SIZE),
+    ):
+        if mode not in MODES:
+            raise ValueError(f"Record mode {mode} not one of {', '.join(MODES)}")
+        self.mode = mode
+        self.height = height
+        self.dropped = 0
+        self.max_depth = 0
+        self._process = None
+        if mode == "none":
+            return
+
+        self._frames = mp.Queue(maxsize)
+        self._written = mp.Value("i", 0)
+        self._segments = mp.Value("i", 0)
+        self._process = mp.Process(
+            target=_encode,
+            args=(
+                self._frames,
+                path,
+                fps,
+                round(segment_s * fps),
+                int(segment_mb * 2**20),
+                self._written,
+                self._segments,
+            ),
+            name="Encoder",
+            daemon=True,
+        )
+        self._process.start()
+
+    def put(self, frame: np.ndarray, config: dict) -> bool:
+        """Queue frame to be recorded, cropped to the ROI in config or
+        downscaled first, returns False if it was dropped.
+        """
+        if self._process is None:
+            return True
+        try:
+            self._frames.put_nowait(self._prepare(frame, config))
+        except queue.Full:
+            self.dropped += 1
+            return False
+        self.max_depth = max(self.max_depth, self.depth())
+        return True
+
+    def depth(self) -> int:
+        try:
+            return self._frames.qsize()
+        except NotImplementedError:
+            # not available on macOS
+            return -1
+
+    def stats(self) -> dict:
+        if self._process is None:
+            return {"mode": self.mode}
+        return {
+            "depth": self.depth(),
+            "max_depth": self.max_depth,
+            "processed": self._written.value,
+            "dropped": self.dropped,
+            "segments": self._segments.value,
+        }
+
+    def close(self):
+        """Encode the frames still queued, then close the last segment.
+        If the encoder has died or stopped taking frames, it is stopped
+        without waiting, so the session can still end.
+        """
+        if self._process is None:
+            return
+        try:
+            if not self._process.is_alive():
+                raise queue.Full
+            self._frames.put(None, timeout=CLOSE_TIMEOUT)
+        except queue.Full:
+            # nothing will take the frames left, don't wait to flush them
+            self._frames.cancel_join_thread()
+            self._process.terminate()
+        self._process.join()
+
+        if self._process.exitcode:
+            print(
+                f"Encoder process exited with code {self._process.exitcode}, "
+                "the recording may be incomplete",
+                file=sys.stderr,
+            )
+
+    def _prepare(self, frame: np.ndarray, config: dict) -> np.ndarray:
+        if self.mode == "roi":
+            x, y = int(config["X"]), int(config["Y"])
+            return frame[y : y + int(config["H"]), x : x + int(config["W"])].copy()
+        if self.mode == "downscaled" and self.height < frame.shape[0]:
+            width = round(frame.shape[1] * self.height / frame.shape[0])
+            return cv2.resize(frame, (width, self.height), interpolation=cv2.INTER_AREA)
+        return frame
+
+
+def segment_path(path: str, index: int) -> str:
+    stem, ext = os.path.splitext(path)
+    return f"{stem}_{index:03d}{ext}"
+
+
+def _encode(
+    frames: mp.Queue,
+    path: str,
+    fps: float,
+    segment_frames: int,
+    segment_bytes: int,
+    written: mp.Value,
+    segments: mp.Value,
+):
+    """Encoder process, writes frames until None is received. A new
+    segment is started when the current one is long or large enough, or
+    when the frame size changes (e.g. the ROI was re-registered).
+    """
+    segmented = segment_frames > 0 or segment_bytes > 0
+    fourcc = cv2.VideoWriter_fourcc(*"mp4v")
+    out, current, shape, n = None, None, None, 0
+    while True:
+        frame = frames.get()
+        if frame is None:
+            break
+
+        if out is not None and (
+            frame.shape != shape
+            or (segment_frames and n >= segment_frames)
+            or (
+                segment_bytes
+                and n % SIZE_CHECK_EVERY == 0
+                and os.path.getsize(current) >= segment_bytes
+            )
+        ):
+            out.release()
+            out = None
+
+        if out is None:
+            index = segments.value
+            current = segment_path(path, index) if segmented or index else path
+            shape, n = frame.shape, 0
+            out = cv2.VideoWriter(current, fourcc, fps, frame.shape[1::-1])
+            segments.value += 1
+
+        out.write(frame)
+        n += 1
+        written.value += 1
+
+    if out is not None:
+        out.release()
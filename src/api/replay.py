@@ -0,0 +1,88 @@
+import sys
+import time
+
+import cv2
+import numpy as np
+
+
+class ReplayCapture:
+    """Stands in for a camera by replaying a recorded video, with the
+    same read, get, isOpened and release as cv2.VideoCapture. Frames are
+    released at speed times the frame rate of the video (1 for real
+    time), or as fast as they are read with speed 0. clock gives the
+    time of the last frame read within the video, so timestamps are the
+    same on every replay however fast the computer is.
+
+    Args:
+        path: video to replay
+        speed: multiple of real time to replay at, 0 for no waiting
+    """
+
+    def __init__(self, path: str, speed: float = 1.0):
+        if speed < 0:
+            raise ValueError(f"Replay speed {speed} can't be negative")
+        self.path = path
+        self.speed = speed
+        self._cap = cv2.VideoCapture(path)
+        if not self._cap.isOpened():
+            raise Exception(f"Error opening video {path} to replay")
+        self.fps = self._cap.get(cv2.CAP_PROP_FPS)
+        self.frames = 0
+        self.behind = 0.0
+        self.finished = False
+        self._started = None
+
+    def read(self) -> tuple:
+        if self._started is None:
+            self._started = time.perf_counter()
+
+        success, frame = self._cap.read()
+        if not success:
+            self.finished = True
+            return False, None
+
+        if self.speed > 0:
+            # when the frame would arrive from a camera
+            due = self._started + self.frames / (self.fps * self.speed)
+            wait = due - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            else:
+                self.behind = max(self.behind, -wait)
+        self.frames += 1
+        return True, frame
+
+    def clock(self) -> float:
+        """Milliseconds into the video of the last frame read"""
+        return max(self.frames - 1, 0) * 1000 / self.fps
+
+    def get(self, prop: int) -> float:
+        return self._cap.get(prop)
+
+    def isOpened(self) -> bool:
+        return self._cap.isOpened()
+
+    def release(self):
+        self._cap.release()
+
+    def stats(self) -> dict:
+        """Frames replayed, the rate they were read at (fps and multiple
+        of real time), and how far (s) reading fell behind the speed.
+        """
+        elapsed = time.perf_counter() - self._started if self._started else 0.0
+        fps = self.frames / elapsed if elapsed > 0 else np.nan
+        return {
+            "frames": self.frames,
+            "fps": fps,
+            "realtime": fps / self.fps,
+            "behind": self.behind,
+        }
+
+    def report(self):
+        stats = self.stats()
+        print(
+            f"Replayed {stats['frames']} frames at {stats['fps']:.1f} fps "
+            f"({stats['realtime']:.2f}x real time), at most "
+            f"{stats['behind']:.3f}s behind",
+            file=sys.stderr,
+        )
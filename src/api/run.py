@@ -1,5 +1,8 @@
 import click
 from src.api.live import analyze_live_video
+from src.api.recorder import MODES
+from src.api.sinks import make_sink
+from src.config import ENV
 
 
 @click.command()
@@ -36,8 +39,136 @@ from src.api.live import analyze_live_video
     is_flag=True,
     help="Create debug session with camera other than GoPro",
 )
-def main(input_source, output_file, calibrate, buffer, debug):
-    analyze_live_video(input_source, output_file, calibrate, buffer, debug)
+@click.option(
+    "-l",
+    "lag",
+    prompt=False,
+    default=float(ENV.LIVE_LAG),
+    help="Seconds that the smoothed cell loss lags behind, more is smoother",
+)
+@click.option(
+    "-s",
+    "sinks",
+    prompt=False,
+    multiple=True,
+    default=["stdout"],
+    help="""Where to send results, can be given more than once: stdout,
+            a .ndjson or .csv file to append to, unix:/path/to/socket
+            or tcp:host:port""",
+)
+@click.option(
+    "--headless",
+    is_flag=True,
+    help="Don't show a preview, for computers without a display (use --nocal)",
+)
+@click.option(
+    "--preview-fps",
+    "preview_fps",
+    prompt=False,
+    default=float(ENV.PREVIEW_FPS),
+    help="Number of times a second the preview is redrawn",
+)
+@click.option(
+    "--preview-width",
+    "preview_width",
+    prompt=False,
+    default=int(ENV.PREVIEW_WIDTH),
+    help="Width of the preview in pixels",
+)
+@click.option(
+    "--stop-file",
+    "stop_file",
+    prompt=False,
+    default=None,
+    help="Stop the session cleanly when this file is created",
+)
+@click.option(
+    "--record",
+    "record",
+    type=click.Choice(list(MODES), case_sensitive=False),
+    default=ENV.RECORD_MODE,
+    help="Record full frames, only the ROI, downscaled frames, or nothing",
+)
+@click.option(
+    "--segment-s",
+    "segment_s",
+    prompt=False,
+    default=float(ENV.RECORD_SEGMENT_S),
+    help="Start a new recording file every this many seconds (0 for one file)",
+)
+@click.option(
+    "--segment-mb",
+    "segment_mb",
+    prompt=False,
+    default=float(ENV.RECORD_SEGMENT_MB),
+    help="Start a new recording file once it is this many MB (0 for no limit)",
+)
+@click.option(
+    "--reregister-s",
+    "reregister_s",
+    prompt=False,
+    default=float(ENV.REREGISTER_S),
+    help="Seconds between checks that the camera hasn't moved (0 to turn off)",
+)
+@click.option(
+    "--reregister-px",
+    "reregister_px",
+    prompt=False,
+    default=float(ENV.REREGISTER_PX),
+    help="Pixels the camera must move by before the ROI is updated",
+)
+@click.option(
+    "--replay",
+    "replay",
+    prompt=False,
+    default=None,
+    help="Replay this video file instead of reading from a camera (use --nocal)",
+)
+@click.option(
+    "--speed",
+    "speed",
+    prompt=False,
+    default=1.0,
+    help="Multiple of real time to replay at, 0 for as fast as possible",
+)
+def main(
+    input_source,
+    output_file,
+    calibrate,
+    buffer,
+    debug,
+    lag,
+    sinks,
+    headless,
+    preview_fps,
+    preview_width,
+    stop_file,
+    record,
+    segment_s,
+    segment_mb,
+    reregister_s,
+    reregister_px,
+    replay,
+    speed,
+):
+    analyze_live_video(
+        input_source if replay is None else replay,
+        output_file,
+        calibrate,
+        buffer,
+        debug,
+        lag,
+        [make_sink(s) for s in sinks],
+        0 if headless else preview_fps,
+        preview_width,
+        stop_file,
+        record=record,
+        segment_s=segment_s,
+        segment_mb=segment_mb,
+        reregister_s=reregister_s,
+        reregister_px=reregister_px,
+        replay_speed=None if replay is None else speed,
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,189 @@
+import csv
+import json
+import os
+import socket
+import sys
+import time
+from abc import ABC, abstractmethod
+from typing import Callable, List
+
+from src.config import ENV
+from src.extra.queues import QueueWorker
+
+# Fields of each live result, in the order they are written
+FIELDS = (
+    "time",
+    "frame",
+    "t",
+    "t_smooth",
+    "smooth_bri",
+    "smooth_loss",
+    "raw_bri",
+    "cell_loss",
+)
+
+
+class Sink(ABC):
+    """Destination for live results. Records (dicts with FIELDS) passed
+    to emit are queued and written in batches by the sink's own thread,
+    so a slow destination never holds up the analysis. If it falls too
+    far behind, the oldest records are dropped.
+
+    Args:
+        batch: maximum number of records written at once
+        maxsize: number of records that can wait to be written
+    """
+
+    name = "sink"
+
+    def __init__(
+        self,
+        batch: int = int(ENV.SINK_BATCH),
+        maxsize: int = int(ENV.LIVE_QUEUE_SIZE) * 16,
+    ):
+        self._worker = QueueWorker(
+            self._write, maxsize, "oldest", f"{self.name}Sink", batch=batch
+        )
+
+    def emit(self, record: dict):
+        self._worker.put(record)
+
+    def stats(self) -> dict:
+        return self._worker.stats()
+
+    def close(self):
+        """Write the records still waiting, then close the destination"""
+        self._worker.close()
+        self._close()
+
+    @abstractmethod
+    def _write(self, records: List[dict]):
+        pass
+
+    def _close(self):
+        pass
+
+
+class StdoutSink(Sink):
+    """Lines of key=value, as printed by earlier versions. cell_loss
+    stays last, so that scripts splitting on it still work.
+    """
+
+    name = "stdout"
+
+    def _write(self, records: List[dict]):
+        sys.stdout.write("".join(f"{format_line(r)}\n" for r in records))
+        sys.stdout.flush()
+
+
+class FileSink(Sink):
+    """Append-only file of newline-delimited JSON, or CSV if the path
+    ends in .csv. Writes are buffered, and flushed at most every
+    flush_every seconds (and when closed).
+    """
+
+    name = "file"
+
+    def __init__(self, path: str, flush_every: float = 1.0, **kwargs):
+        self.csv = path.endswith(".csv")
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._fp = open(path, "a", newline="" if self.csv else None)
+        if self.csv:
+            self._csv = csv.DictWriter(self._fp, fieldnames=FIELDS)
+            if new:
+                self._csv.writeheader()
+        self.flush_every = flush_every
+        self._flushed = time.monotonic()
+        super().__init__(**kwargs)
+
+    def _write(self, records: List[dict]):
+        if self.csv:
+            self._csv.writerows(records)
+        else:
+            self._fp.write("".join(f"{json.dumps(r)}\n" for r in records))
+        if time.monotonic() - self._flushed > self.flush_every:
+            self._fp.flush()
+            self._flushed = time.monotonic()
+
+    def _close(self):
+        self._fp.close()
+
+
+class SocketSink(Sink):
+    """Newline-delimited JSON sent to a local Unix socket (unix:/path)
+    or TCP socket (tcp:host:port). If the connection fails, records are
+    dropped and it is tried again with the next batch, so the live
+    session carries on if the listener is restarted.
+    """
+
+    name = "socket"
+
+    def __init__(self, address: str, timeout: float = 1.0, **kwargs):
+        kind, _, where = address.partition(":")
+        if kind == "unix":
+            self._family, self._address = socket.AF_UNIX, where
+        elif kind == "tcp":
+            host, _, port = where.rpartition(":")
+            self._family, self._address = socket.AF_INET, (host, int(port))
+        else:
+            raise ValueError(
+                f"Socket address {address} is not unix:path or tcp:host:port"
+            )
+        self.timeout = timeout
+        self.failed = 0
+        self._sock = None
+        super().__init__(**kwargs)
+
+    def stats(self) -> dict:
+        """As for other sinks, with the records that couldn't be sent"""
+        return {**super().stats(), "failed": self.failed}
+
+    def _write(self, records: List[dict]):
+        data = "".join(f"{json.dumps(r)}\n" for r in records).encode()
+        try:
+            if self._sock is None:
+                self._sock = socket.socket(self._family, socket.SOCK_STREAM)
+                self._sock.settimeout(self.timeout)
+                self._sock.connect(self._address)
+            self._sock.sendall(data)
+        except OSError:
+            self.failed += len(records)
+            self._close()
+
+    def _close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+
+class CallbackSink(Sink):
+    """Call a function with each batch of records, in the sink's thread"""
+
+    name = "callback"
+
+    def __init__(self, callback: Callable[[List[dict]], None], **kwargs):
+        self.callback = callback
+        super().__init__(**kwargs)
+
+    def _write(self, records: List[dict]):
+        self.callback(records)
+
+
+def make_sink(spec: str) -> Sink:
+    """Sink from a command line value: stdout (or -), unix:/path,
+    tcp:host:port, or the path of an .ndjson/.csv file.
+    """
+    if spec in ("stdout", "-"):
+        return StdoutSink()
+    if spec.startswith(("unix:", "tcp:")):
+        return SocketSink(spec)
+    return FileSink(spec)
+
+
+def format_line(record: dict) -> str:
+    return (
+        f"t={record['t']:.3f}, t_smooth={record['t_smooth']:.3f}, "
+        f"smooth_bri={record['smooth_bri']:.3f}, "
+        f"smooth_loss={record['smooth_loss']:.3f}, "
+        f"raw_bri={record['raw_bri']:.3f}, cell_loss={record['cell_loss']:.3f}"
+    )
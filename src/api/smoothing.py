@@ -0,0 +1,81 @@
+from typing import Optional, Tuple
+
+import numpy as np
+
+
+class CausalGaussian:
+    """Streaming version of the gaussian smoothing in HistogramPipeline,
+    using only samples that have already arrived. Each smoothed value is
+    for the sample lag samples ago, using the gaussian kernel truncated
+    to the samples up to now. With lag equal to the kernel radius (the
+    default), the output is the same as scipy.ndimage.gaussian_filter1d
+    away from the start; smaller lags give an earlier, less smooth
+    estimate. The kernel has a fixed length, so each sample takes the
+    same time however long the stream runs.
+
+    Args:
+        sigma: standard deviation of the gaussian, in samples
+        lag: number of samples the output lags behind, at most the radius
+        truncate: radius of the kernel in standard deviations, as in scipy
+    """
+
+    def __init__(self, sigma: float, lag: Optional[int] = None, truncate: float = 4.0):
+        radius = int(truncate * sigma + 0.5)
+        self.lag = radius if lag is None else int(min(max(lag, 0), radius))
+
+        # weights from oldest sample (radius before the output) to newest
+        offsets = np.arange(-radius, self.lag + 1)
+        weights = np.exp(-0.5 * (offsets / max(sigma, 1e-12)) ** 2)
+        self._weights = weights / weights.sum()
+        self._size = len(weights)
+
+        # ring buffer written twice, so the latest samples are contiguous
+        self._buffer = np.zeros(2 * self._size)
+        self._count = 0
+
+    def update(self, value: float) -> float:
+        """Add the newest sample and return the smoothed value for the
+        sample lag samples ago. Until the kernel is full, the weights
+        are renormalised over the samples received so far.
+        """
+        i = self._count % self._size
+        self._buffer[i] = self._buffer[i + self._size] = value
+        self._count += 1
+
+        window = self._buffer[i + 1 : i + 1 + self._size]
+        if self._count >= self._size:
+            return float(np.dot(window, self._weights))
+        n = self._count
+        return float(np.dot(window[-n:], self._weights[-n:]) / self._weights[-n:].sum())
+
+
+def live_sigma(gauss_std: float, slice_freq: int, buffer: int) -> float:
+    """Offline smoothing is GAUSS_STD sliced rows of SLICE_FREQ frames,
+    live samples are averages of buffer frames, so in live samples the
+    same smoothing is gauss_std * slice_freq / buffer.
+    """
+    return gauss_std * slice_freq / buffer
+
+
+def divergence(
+    live: Tuple[np.array, np.array], offline: Tuple[np.array, np.array]
+) -> dict:
+    """How far a live series is from the offline one, each given as
+    (time, value) in the same units. The offline series is interpolated
+    at the live times that it covers.
+    """
+    t, y = (np.asarray(a, dtype=float) for a in live)
+    t_off, y_off = (np.asarray(a, dtype=float) for a in offline)
+    inside = (t >= t_off.min()) & (t <= t_off.max())
+    if inside.sum() < 2:
+        raise ValueError("The live and offline series don't overlap in time")
+
+    diff = y[inside] - np.interp(t[inside], t_off, y_off)
+    ref = y[inside] - diff
+    return {
+        "n": int(inside.sum()),
+        "rmse": float(np.sqrt(np.mean(diff**2))),
+        "max_abs": float(np.max(np.abs(diff))),
+        "bias": float(np.mean(diff)),
+        "r": float(np.corrcoef(y[inside], ref)[0, 1]),
+    }
@@ -0,0 +1,111 @@
+import click
+
+from src.config import ENV
+from src.core.results_io import FORMATS
+from src.run.batch import find_inlets, run_batch
+
+
+@click.command()
+@click.option(
+    "-i",
+    "inlets",
+    multiple=True,
+    prompt=False,
+    help="Path to folder with videos + excel file, can be given many times",
+)
+@click.option(
+    "-p",
+    "parent",
+    prompt=False,
+    default=None,
+    help="Path to folder containing many inlet folders, each of which is run",
+)
+@click.option(
+    "-t",
+    "type",
+    type=click.Choice(["default", "workflow1"], case_sensitive=False),
+    default="default",
+    prompt=False,
+    help="Analysis type, same as for src.main",
+)
+@click.option(
+    "-w",
+    "workers",
+    default=1,
+    type=int,
+    prompt=False,
+    help="Number of folders to run at the same time",
+)
+@click.option(
+    "-j",
+    "--jobs",
+    "jobs",
+    default=1,
+    type=int,
+    prompt=False,
+    help="Number of processes to slice each video with",
+)
+@click.option(
+    "--video/--novideo",
+    "save_video",
+    default=True,
+    help="Save the cropped result video, or only the sliced brightness",
+)
+@click.option(
+    "-s",
+    "summary",
+    default="batch_summary.csv",
+    prompt=False,
+    help="Where to write the table of status and wall time for each folder",
+)
+@click.option(
+    "--cache/--nocache",
+    "cache_sliced",
+    default=True,
+    help="Reuse sliced data from an earlier run of the same videos",
+)
+@click.option(
+    "-f",
+    "--format",
+    "results_format",
+    default=ENV.RESULTS_FORMAT,
+    type=click.Choice(list(FORMATS), case_sensitive=False),
+    prompt=False,
+    help="Format to save results data in, xlsx can be made later with src.export",
+)
+def main(
+    inlets,
+    parent,
+    type,
+    workers,
+    jobs,
+    save_video,
+    summary,
+    cache_sliced,
+    results_format,
+):
+    inlets = list(inlets)
+    if parent is not None:
+        inlets += find_inlets(parent)
+    if not inlets:
+        raise click.UsageError("No inlet folders, use -i or -p")
+
+    df = run_batch(
+        inlets,
+        type,
+        workers,
+        summary,
+        jobs=jobs,
+        save_video=save_video,
+        cache_sliced=cache_sliced,
+        results_format=results_format,
+    )
+    print(df.to_string(index=False))
+
+    # non-zero exit if any folder failed, so scheduled runs can alert
+    if (df.status != "ok").any():
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
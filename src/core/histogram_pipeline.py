@@ -9,15 +9,19 @@ import bisect
 import math
 import os
 import warnings
-from typing import Tuple
+from typing import Optional, Tuple
 
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 import scipy.ndimage
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 
 from ..config import ENV
 from ..extra.tools import check_dir_make
+from .results_io import results_path, save_results
+from .sliced_io import load_sliced
 
 
 class HistogramPipeline:
@@ -27,13 +31,15 @@ class HistogramPipeline:
     as applicable.
 
     Args:
-        path_sliced: path to sliced brightness csv
+        path_sliced: path to sliced brightness (.npy or .csv)
         data_dict: dictionary with cell and/or sensor data
         out_folder: folder to save results
         window: slice window (in pixels), down from top
         t_correct: time between resonator + sensor, seconds
-        xlsxname: xlsx file to save xlsx file
+        xlsxname: file to save results to, or None to not save
         fps: time per frame, can be accessed through video
+        results_format: format to save results in (xlsx, csv, parquet,
+            feather or npz), which replaces the extension of xlsxname
     """
 
     def __init__(
@@ -50,6 +56,7 @@ class HistogramPipeline:
         slice_freq: int = int(ENV.SLICE_FREQ),
         background: int = 0.0,
         coeffs: tuple = (float(ENV.ALPHA_BRI), float(ENV.BETA_BRI)),
+        results_format: str = ENV.RESULTS_FORMAT,
     ):
         self.s_per_frame = s_per_frame
         self.vid_start = vid_start
@@ -77,21 +84,31 @@ class HistogramPipeline:
         # smooth brightness data for saving and plotting
         self.brightness = self._transform_brightness(self.brightness_raw)
 
-        # save data to xlsx if path provided
+        # save data if path provided
+        self.results = None
         if xlsxname is not None:
-            self._data_to_xlsx(xlsxname)
+            self.results = self._save_data(results_path(xlsxname, results_format))
 
     def plot(
         self,
         title: str,
         save: bool = False,
         filename: str = ENV.HIST_PLOT,
-    ):
+        headless: bool = False,
+        decimate: bool = True,
+    ) -> Optional[Figure]:
+        """Plot brightness alongside cell counts and sensor data. When headless,
+        the figure is drawn with the Agg backend outside of pyplot, so it is
+        safe to plot from a background thread. With decimate, long brightness
+        series are reduced to the min and max in each pixel column before
+        drawing, which looks the same. The figure is closed once saved,
+        otherwise it is returned.
+        """
         # create figure to plot
-        fig, ax = self._make_fig(title)
+        fig, ax = self._make_fig(title, headless)
 
         # plot brightness onto ax
-        self._plot_brightness(ax, self.brightness)
+        self._plot_brightness(ax, self.brightness, decimate)
 
         # only plot cellcount if data exists
         if not np.all(np.isnan(self.cellcount)):
@@ -104,19 +121,29 @@ class HistogramPipeline:
         # tight layout to account for new axes
         fig.tight_layout()
 
-        # save fig to destination
-        if save:
-            fig.savefig(f"{self.out_folder}{os.sep}{filename}")
+        # save fig to destination, then release it
+        if not save:
+            return fig
+        fig.savefig(f"{self.out_folder}{os.sep}{filename}")
+        if headless:
+            fig.clf()
+        else:
+            plt.close(fig)
 
-    def _plot_brightness(self, ax: plt.Axes, brightness: np.array):
+    def _plot_brightness(self, ax: plt.Axes, brightness: np.array, decimate: bool):
         # plot brightness data onto fig -> always runs
-        x = brightness[:, 0]
+        x, y = brightness[:, 0], brightness[:, 1]
+        if decimate:
+            # at most one bin per pixel column of the figure
+            fig = ax.get_figure()
+            x, y = minmax_decimate(x, y, int(fig.get_figwidth() * fig.dpi))
         ax.plot(
             x,
-            brightness[:, 1],
+            y,
             "maroon",
             label="Predicted Cell Loss",
         )
+        x = brightness[:, 0]
         ax.set_xticks(np.arange(math.floor(min(x)), math.ceil(max(x)) + 1, 1.0))
 
     def _plot_cellcount(self, ax: plt.Axes, cellcount: np.array):
@@ -142,9 +169,14 @@ class HistogramPipeline:
         )
         ax3.spines["right"].set_position(("outward", 70))
 
-    def _make_fig(self, title: str) -> Tuple[plt.Figure, plt.Axes]:
-        # create figure to plot
-        fig, ax = plt.subplots(dpi=200)
+    def _make_fig(self, title: str, headless: bool) -> Tuple[Figure, plt.Axes]:
+        # create figure to plot, outside of pyplot if headless
+        if headless:
+            fig = Figure(dpi=200)
+            FigureCanvasAgg(fig)
+            ax = fig.subplots()
+        else:
+            fig, ax = plt.subplots(dpi=200)
         fig.set_figheight(5)
         fig.set_figwidth(12)
         fig.autofmt_xdate()
@@ -240,10 +272,10 @@ class HistogramPipeline:
         return _brightness
 
     def _read_sliced(self, path_sliced: str, window: tuple) -> np.array:
-        """Read in the sliced data from csv and convert slice number to
-        time using s_per_frame and slice_freq
+        """Read in the sliced data (.npy or csv) and convert slice number
+        to time using s_per_frame and slice_freq
         """
-        sliced = np.loadtxt(path_sliced, delimiter=",")
+        sliced = load_sliced(path_sliced)
         means = sliced[:, window[0] : window[1]].mean(axis=1)
         time = (
             np.linspace(0, len(means), len(means)) * self.s_per_frame * self.slice_freq
@@ -251,7 +283,11 @@ class HistogramPipeline:
         brightness = np.stack((time, means), axis=1)
         return brightness
 
-    def _data_to_xlsx(self, xlsxname: str):
+    def _save_data(self, filename: str) -> str:
+        return save_results(self.to_frame(), f"{self.out_folder}{os.sep}{filename}")
+
+    def to_frame(self) -> pd.DataFrame:
+        """Table of brightness, cell count and sensor data as saved"""
         df = pd.DataFrame(
             data=np.hstack(
                 (
@@ -276,4 +312,29 @@ class HistogramPipeline:
             df["Time (min) - sensor"] = pd.Series(self.sensordata[:, 0])
             df["Sensor"] = pd.Series(self.sensordata[:, 1])
 
-        df.to_excel(f"{self.out_folder}{os.sep}{xlsxname}", index=False)
+        return df
+
+
+def minmax_decimate(x: np.array, y: np.array, n_bins: int) -> Tuple[np.array, np.array]:
+    """Reduce a series to the first and last point, and the min and max
+    of y in each of n_bins equal bins, in their original order. With a
+    bin per pixel column, the line drawn looks the same as the full one.
+    """
+    n = len(y)
+    if n_bins < 1 or n <= 2 * n_bins:
+        return x, y
+
+    size = math.ceil(n / n_bins)
+    padded = np.full(size * math.ceil(n / size), np.nan)
+    padded[:n] = y
+    bins = padded.reshape(-1, size)
+    offset = np.arange(len(bins)) * size
+    keep = np.concatenate(
+        (
+            [0, n - 1],
+            offset + np.nanargmin(bins, axis=1),
+            offset + np.nanargmax(bins, axis=1),
+        )
+    )
+    keep = np.unique(keep)
+    return x[keep], y[keep]
@@ -0,0 +1,200 @@
+import bisect
+import itertools
+from typing import List, Tuple
+
+import numpy as np
+import pandas as pd
+import scipy.ndimage
+
+from ..config import ENV
+from .sliced_io import load_sliced
+
+
+class HistogramSweep:
+    """Evaluate a grid of HistogramPipeline settings (window, gauss_std,
+    t_correct and calibration coeffs) on one set of sliced data, without
+    writing any files. The sliced data is read once, every window is
+    averaged from one cumulative sum over the rows, and smoothing and
+    calibration are done for all combinations at once in NumPy.
+
+    Args:
+        path_sliced: path to sliced brightness (.npy or .csv)
+        data_dict: dictionary with cell and/or sensor data
+        s_per_frame: time per frame, can be accessed through video
+        vid_start: time the video starts, in seconds
+        slice_freq: number of frames averaged in each sliced row
+        background: brightness to subtract from the data
+    """
+
+    def __init__(
+        self,
+        path_sliced: str,
+        data_dict: dict = {"cells": np.empty(0), "sensor": np.empty(0)},
+        s_per_frame: float = float(ENV.TIME_PER_FRAME),
+        vid_start: float = 0.0,
+        slice_freq: int = int(ENV.SLICE_FREQ),
+        background: float = 0.0,
+    ):
+        sliced = np.asarray(load_sliced(path_sliced), dtype=float)
+
+        # sum over columns, so any window mean is a difference of two columns
+        self._cumsum = np.concatenate(
+            (np.zeros((len(sliced), 1)), np.cumsum(sliced, axis=1)), axis=1
+        )
+        self.height = sliced.shape[1]
+        self.background = background
+        self.vid_start = vid_start
+
+        # same time axis as HistogramPipeline._read_sliced, in seconds
+        n = len(sliced)
+        self.time = np.linspace(0, n, n) * s_per_frame * slice_freq
+
+        # reference data, time in minutes as plotted
+        self.reference = {}
+        for name in ("cells", "sensor"):
+            data = _as_array(data_dict.get(name, np.empty(0)))
+            if data.size and not np.all(np.isnan(data)):
+                self.reference[name] = np.stack((data[:, 0] / 60, data[:, 1]), axis=1)
+
+    def window_means(self, windows: List[Tuple[int, int]]) -> np.array:
+        """Mean brightness of each window for every row, minus the
+        background, shape (n_windows, n_rows).
+        """
+        top = np.array([min(w[0], self.height) for w in windows])
+        bottom = np.array([min(w[1], self.height) for w in windows])
+        sums = self._cumsum[:, bottom] - self._cumsum[:, top]
+        return (sums / (bottom - top)).T - self.background
+
+    def curves(
+        self,
+        windows: List[Tuple[int, int]] = [(int(ENV.WIN_TOP), int(ENV.WIN_BOTTOM))],
+        gauss_stds: List[float] = [int(ENV.GAUSS_STD)],
+        t_corrects: List[float] = [float(ENV.TIME_CORRECT)],
+        coeffs: List[Tuple[float, float]] = [
+            (float(ENV.ALPHA_BRI), float(ENV.BETA_BRI))
+        ],
+    ) -> List[Tuple[np.array, np.array]]:
+        """Calibrated brightness curves, the same as HistogramPipeline.brightness
+        for each combination. Returns one (time, brightness) pair per t_correct,
+        time in minutes and brightness of shape (n_coeffs, n_stds, n_windows,
+        len(time)), since t_correct only changes the time and the trimming.
+        """
+        coeffs = np.asarray(coeffs, dtype=float)
+        means = self.window_means(windows)
+        result = []
+        for t_correct in t_corrects:
+            time, smoothed = self._smooth(means, gauss_stds, t_correct)
+            result.append((time, _calibrate(smoothed, coeffs)))
+        return result
+
+    def run(
+        self,
+        windows: List[Tuple[int, int]] = [(int(ENV.WIN_TOP), int(ENV.WIN_BOTTOM))],
+        gauss_stds: List[float] = [int(ENV.GAUSS_STD)],
+        t_corrects: List[float] = [float(ENV.TIME_CORRECT)],
+        coeffs: List[Tuple[float, float]] = [
+            (float(ENV.ALPHA_BRI), float(ENV.BETA_BRI))
+        ],
+    ) -> pd.DataFrame:
+        """Fit of every combination of settings against the cell count
+        and sensor data, one row per combination. The calibrated curve is
+        interpolated at the times of the reference data, and compared
+        using the RMSE and the Pearson correlation.
+        """
+        coeffs = np.asarray(coeffs, dtype=float)
+        means = self.window_means(windows)
+
+        df = pd.DataFrame(
+            list(
+                itertools.product(t_corrects, gauss_stds, windows, range(len(coeffs)))
+            ),
+            columns=["t_correct", "gauss_std", "window", "coeff"],
+        )
+        df["alpha"], df["beta"] = coeffs[df.coeff, 0], coeffs[df.coeff, 1]
+
+        shape = (len(t_corrects), len(gauss_stds), len(windows), len(coeffs))
+        metrics = {
+            f"{name}_{m}": np.full(shape, np.nan)
+            for name in self.reference
+            for m in ("rmse", "r")
+        }
+        for i, t_correct in enumerate(t_corrects):
+            time, smoothed = self._smooth(means, gauss_stds, t_correct)
+            for name, ref in self.reference.items():
+                rmse, r = _fit(time, smoothed, coeffs, ref)
+                metrics[f"{name}_rmse"][i], metrics[f"{name}_r"][i] = rmse, r
+
+        for column, values in metrics.items():
+            df[column] = values.ravel()
+
+        return df.drop(columns="coeff")
+
+    def _smooth(
+        self, means: np.array, gauss_stds: List[float], t_correct: float
+    ) -> Tuple[np.array, np.array]:
+        """Trim to the span of the reference data like HistogramPipeline
+        and smooth every window with every gauss_std, shape (n_stds,
+        n_windows, n_rows). A gauss_std of 0 leaves the data unsmoothed.
+        """
+        time = (self.time + self.vid_start + t_correct) / 60
+        if self.reference:
+            ref_time = np.concatenate([r[:, 0] for r in self.reference.values()])
+            start = bisect.bisect(time, ref_time.min())
+            stop = bisect.bisect(time, ref_time.max())
+            time, means = time[start:stop], means[:, start:stop]
+
+        smoothed = np.stack(
+            [
+                scipy.ndimage.gaussian_filter1d(means, sigma=s, axis=-1) if s else means
+                for s in gauss_stds
+            ]
+        )
+        return time, smoothed
+
+
+def _calibrate(smoothed: np.array, coeffs: np.array) -> np.array:
+    """Apply every pair of coeffs, adding a leading axis"""
+    shape = (-1,) + (1,) * smoothed.ndim
+    return coeffs[:, 0].reshape(shape) * smoothed + coeffs[:, 1].reshape(shape)
+
+
+def _fit(
+    time: np.array, smoothed: np.array, coeffs: np.array, ref: np.array
+) -> Tuple[np.array, np.array]:
+    """RMSE and correlation against ref, shape (n_stds, n_windows,
+    n_coeffs). Interpolation is linear, so it is done on the smoothed
+    data and calibration is applied to the few interpolated points.
+    """
+    n_std, n_win, _ = smoothed.shape
+    rmse = np.full((n_std, n_win, len(coeffs)), np.nan)
+    r = np.full_like(rmse, np.nan)
+
+    # only compare points within the span of the curve
+    inside = (ref[:, 0] >= time[0]) & (ref[:, 0] <= time[-1]) if len(time) else []
+    if np.sum(inside) < 2:
+        return rmse, r
+    x, y = ref[inside, 0], ref[inside, 1]
+
+    flat = smoothed.reshape(-1, smoothed.shape[-1])
+    pred = np.stack([np.interp(x, time, f) for f in flat]).reshape(n_std, n_win, -1)
+    cal = np.moveaxis(_calibrate(pred, coeffs), 0, -2)
+
+    rmse[:] = np.sqrt(np.mean((cal - y) ** 2, axis=-1))
+    r[:] = _pearson(cal, y)
+    return rmse, r
+
+
+def _pearson(pred: np.array, y: np.array) -> np.array:
+    """Correlation along the last axis of pred with y"""
+    dp = pred - pred.mean(axis=-1, keepdims=True)
+    dy = y - y.mean()
+    denom = np.sqrt((dp**2).sum(axis=-1) * (dy**2).sum())
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (dp * dy).sum(axis=-1) / denom
+
+
+def _as_array(data) -> np.array:
+    """Reference data may be a DataFrame or an array, copy so
+    that the caller's data is not changed.
+    """
+    return np.array(getattr(data, "values", data), dtype=float)
@@ -6,14 +6,37 @@ Created on Sun Jun 13 12:08:37 2021
 @author: RileyBallachay
 """
 import os
-from typing import List, Tuple
+import queue
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import List, Optional, Tuple
 
 import cv2
 import numpy as np
 from src.config import ENV
-from src.extra.tools import check_dir_make
+from src.core.sliced_io import (
+    compute_background,
+    load_meta,
+    load_sliced,
+    meta_path,
+    save_sliced,
+)
+from src.extra.cache import DiskCache, fingerprint_file, hash_file, hash_key
+from src.extra.queues import TimedQueue
+from src.extra.tools import check_dir_make, read_frame, seek_frame
 from src.run.resize import get_downscaled_video
 
+# Number of ORB features found in each image, and the share of the best
+# matches between them kept for registration
+MAX_FEATURES = 2000
+GOOD_MATCH_PERCENT = 0.5
+
+# Seconds the decoder waits for space in the frame queue before checking
+# whether slicing has stopped
+DECODE_POLL = 0.1
+
 
 class ResonatorPipeline:
     def __init__(
@@ -30,9 +53,27 @@ class ResonatorPipeline:
         filename: str = ENV.SLICED_FILENAME,
         downsize: bool = False,
         slice_freq: int = int(ENV.SLICE_FREQ),
+        queue_size: int = int(ENV.QUEUE_SIZE),
+        jobs: int = 1,
+        remainder: str = ENV.SLICE_REMAINDER,
+        batch_size: int = int(ENV.SLICE_BATCH),
+        cache_dir: Optional[str] = ENV.CACHE_DIR,
+        downsize_mode: str = ENV.DOWNSIZE_MODE,
+        downsize_height: int = int(ENV.DOWNSIZE_HEIGHT),
+        checkpoint_every: int = int(ENV.CHECKPOINT_EVERY),
+        cache_sliced: bool = True,
     ):
-        # video is unnecessarily big in native format
-        self.video_path = get_downscaled_video(video_path, downsize)
+        # video is unnecessarily big in native format. it is either
+        # re-encoded to a smaller file first, or the ROI is shrunk
+        # as each frame is cropped
+        if downsize_mode not in ("roi", "file"):
+            raise ValueError(f"Unknown downsize mode {downsize_mode}, use roi or file")
+        self.video_path = get_downscaled_video(
+            video_path, downsize and downsize_mode == "file", downsize_height
+        )
+        self.downsize = downsize and downsize_mode == "roi"
+        self.downsize_height = downsize_height
+        self.size = None
 
         if out_folder is None:
             out_folder = f"{os.sep.join(video_path.split(os.sep)[:-1])}{os.sep}results"
@@ -46,8 +87,32 @@ class ResonatorPipeline:
         self.H = dims["H"]
         self.filename = filename
         self.slice_freq = slice_freq
-
-    def run(self, cropped_vid: str = ENV.CROPPED_FILENAME):
+        self.queue_size = queue_size
+        self.jobs = jobs
+        self.remainder = remainder
+        self.batch_size = batch_size
+        self.cache_dir = cache_dir
+        self.checkpoint_every = checkpoint_every
+        self.cache_sliced = cache_sliced and cache_dir is not None
+        self.downsize_mode = downsize_mode
+
+        # the video is opened once, and shared by registration,
+        # the crop check and the main pass
+        self._cap = None
+        self._sliced = (None, None)
+
+    def run(self, cropped_vid: Optional[str] = ENV.CROPPED_FILENAME):
+        """Register the video against the basis image, slice every frame
+        and save the grouped slices. The cropped video is written to
+        cropped_vid, or skipped if cropped_vid is None. If the same video
+        has already been sliced with the same settings, the cached sliced
+        data is used and the video is not read at all.
+        """
+
+        # reuse sliced data if only downstream parameters have changed
+        slice_path = self._load_cached_sliced()
+        if slice_path is not None:
+            return slice_path
 
         # run normalization (register, brightness)
         self.normalize_data()
@@ -55,11 +120,20 @@ class ResonatorPipeline:
         # check that homography worked
         self._check_crop()
 
-        # run the pipeline, write output video
-        slices = self._pipeline_main(cropped_vid)
+        # size to shrink the ROI to, if downsizing in process
+        self._set_roi_size()
+
+        # run the pipeline, write output video. with more than one job
+        # the video is split into chunks which are sliced in parallel
+        if self.jobs > 1:
+            if cropped_vid is not None:
+                print("The cropped video is not saved when slicing in parallel")
+            rows = self._pipeline_parallel()
+        else:
+            rows = self._pipeline_main(cropped_vid)
 
         # stack data and save
-        slice_path = self._stack_and_save(slices)
+        slice_path = self._stack_and_save(rows)
 
         return slice_path
 
@@ -67,6 +141,15 @@ class ResonatorPipeline:
         # get the 100 frame for registration and normalization
         frame_100 = self._get_frame_100()
 
+        # skip feature matching if this registration has been done before
+        cache, key = self._homography_cache(frame_100)
+        cached = cache.get_json(key) if cache is not None else None
+        if cached is not None:
+            print("Using cached registration")
+            self.homography = np.array(cached["homography"])
+            self.X, self.Y, self.W, self.H = self._inside_frame(cached["roi"])
+            return
+
         # change norm to b+w and gaussian blur
         target_norm, basis_norm = self._norm_transform(
             frame_100, cv2.imread(self.basis)
@@ -75,77 +158,92 @@ class ResonatorPipeline:
         # get homography for registration
         self._get_homography(target_norm, basis_norm)
 
-        self.X, self.Y, self.W, self.H = self._warp_coordinates()
+        self.X, self.Y, self.W, self.H = self._inside_frame(self._warp_coordinates())
+
+        if cache is not None:
+            cache.put_json(
+                key,
+                {
+                    "homography": self.homography.tolist(),
+                    "roi": [self.X, self.Y, self.W, self.H],
+                },
+            )
+
+    def _homography_cache(
+        self, frame_100: np.array
+    ) -> Tuple[Optional[DiskCache], Optional[str]]:
+        """Registration only depends on the basis image, the reference
+        frame and the input dims, so the result is cached on disk under a
+        key made from them. The frame is fingerprinted from a coarse,
+        quantized thumbnail, which is cheap and ignores compression noise.
+        """
+        if self.cache_dir is None:
+            return None, None
+
+        thumb = cv2.resize(
+            cv2.cvtColor(frame_100, cv2.COLOR_BGR2GRAY),
+            (32, 32),
+            interpolation=cv2.INTER_AREA,
+        )
+        key = hash_key(
+            hash_file(self.basis),
+            hash_key((thumb >> 3).tobytes()),
+            frame_100.shape,
+            (self.X, self.Y, self.W, self.H),
+        )
+        cache = DiskCache(
+            f"{self.cache_dir}{os.sep}homography",
+            max_entries=int(ENV.HOMOGRAPHY_CACHE_SIZE),
+        )
+        return cache, key
+
+    def _capture(self) -> cv2.VideoCapture:
+        """Capture shared by every step of the pipeline"""
+        if self._cap is None:
+            self._cap = cv2.VideoCapture(self.video_path)
+        return self._cap
 
-    def _get_frame_100(self) -> np.array:
-        # Grab the first frame from our reference photo
-        vidcap = cv2.VideoCapture(self.video_path)
+    def _release(self):
+        if self._cap is not None:
+            self._cap.release()
+            self._cap = None
 
+    def _get_frame_100(self) -> np.array:
         # take 100th frame to avoid issues with reading
-        # first frame
-        for _ in range(100):
-            success, vid = vidcap.read()
+        # first frame, seeking rather than decoding the first 99
+        success, vid = read_frame(self._capture(), 99)
         if not success:
-            raise Exception(f"Error reading 10th frame from path {self.video_path}")
+            raise Exception(f"Error reading 100th frame from path {self.video_path}")
 
+        # kept so the crop check doesn't need to decode again
+        self.frame_100 = vid
         return vid
 
     def _norm_transform(
         self, image_new: str, image_basis: str
     ) -> Tuple[np.array, np.array]:
-        # Convert images to grayscale
-        im1Gray = cv2.GaussianBlur(
-            cv2.cvtColor(image_new, cv2.COLOR_BGR2GRAY),
-            ksize=(3, 3),
-            sigmaX=3,
-            sigmaY=3,
-        )
-        im2Gray = cv2.GaussianBlur(
-            cv2.cvtColor(image_basis, cv2.COLOR_RGB2GRAY),
-            ksize=(3, 3),
-            sigmaX=3,
-            sigmaY=3,
+        return (
+            norm_image(image_new, cv2.COLOR_BGR2GRAY),
+            norm_image(image_basis, cv2.COLOR_RGB2GRAY),
         )
-        return im1Gray, im2Gray
 
     def _get_homography(self, image_new: np.array, image_basis: np.array):
-        MAX_FEATURES = 2000
-        GOOD_MATCH_PERCENT = 0.5
-
-        # Detect ORB features and compute descriptors.
-        orb = cv2.ORB_create(MAX_FEATURES)
-        keypoints1, descriptors1 = orb.detectAndCompute(image_new, None)
-        keypoints2, descriptors2 = orb.detectAndCompute(image_basis, None)
-
-        # Match features.
-        matcher = cv2.DescriptorMatcher_create(
-            cv2.DESCRIPTOR_MATCHER_BRUTEFORCE_HAMMING
-        )
-        matches = list(matcher.match(descriptors1, descriptors2, None))
-
-        # Sort matches by score
-        matches.sort(key=lambda x: x.distance, reverse=False)
-
-        # Remove not so good matches
-        numGoodMatches = int(len(matches) * GOOD_MATCH_PERCENT)
-        matches = matches[:numGoodMatches]
+        features_new = orb_features(image_new)
+        features_basis = orb_features(image_basis)
+        matches = match_features(features_new, features_basis)
 
         # Draw top matches
         imMatches = cv2.drawMatches(
-            image_new, keypoints1, image_basis, keypoints2, matches, None
+            image_new, features_new[0], image_basis, features_basis[0], matches, None
         )
         cv2.imwrite(f"{self.out_folder}{os.sep}{ENV.MATCHES_FILENAME}", imMatches)
 
-        # Extract location of good matches
-        points1 = np.zeros((len(matches), 2), dtype=np.float32)
-        points2 = np.zeros((len(matches), 2), dtype=np.float32)
-
-        for i, match in enumerate(matches):
-            points1[i, :] = keypoints1[match.queryIdx].pt
-            points2[i, :] = keypoints2[match.trainIdx].pt
-
-        # Find homography
-        self.homography, _ = cv2.findHomography(points1, points2, cv2.RANSAC)
+        self.homography = find_homography(features_new, features_basis, matches)
+        if self.homography is None:
+            raise Exception(
+                f"Registration of {self.video_path} failed, too few features "
+                "matched the basis image"
+            )
 
     def _warp_coordinates(self) -> Tuple[int, int, int, int]:
         # this is the start, or the upper left corner of the mask
@@ -162,71 +260,682 @@ class ResonatorPipeline:
             int(end[0] - start[0]),
         )
 
-    def _check_crop(self):
-        # Check to see if the crop region returns nothing
-        cap = cv2.VideoCapture(self.video_path)
-
-        # get the 5th frame to avoid problems with the first
-        for _ in range(5):
-            success, image = cap.read()
-        cap.release()
-
-        if success:
-            crop_frame = image[self.Y : self.Y + self.H, self.X : self.X + self.W, :]
-            if np.all((crop_frame == 0)):
-                raise Exception(
-                    "The crop region is empty - this typically happens when the basis image need to be reset. Please see how to reset basis image in the README."
-                )
+    def _inside_frame(
+        self, roi: Tuple[int, int, int, int]
+    ) -> Tuple[int, int, int, int]:
+        """ROI cut down to the part inside the frame, so that every crop
+        (and every slice) has the same size when registration moves the
+        ROI past the edge.
+        """
+        inside = _clip_roi(roi, self.frame_100.shape)
+        if inside != tuple(roi):
+            print(f"The ROI {tuple(roi)} is past the edge of the frame, using {inside}")
+        return inside
 
-    def _pipeline_main(self, cropped_vid: str) -> List[np.array]:
-
-        cap = cv2.VideoCapture(self.video_path)
+    def _check_crop(self):
+        # Check to see if the crop region returns nothing, using
+        # the frame already decoded for registration
+        image = getattr(self, "frame_100", None)
+        if image is None:
+            image = self._get_frame_100()
+
+        crop_frame = image[self.Y : self.Y + self.H, self.X : self.X + self.W, :]
+        if np.all((crop_frame == 0)):
+            raise Exception(
+                "The crop region is empty - this typically happens when the basis image need to be reset. Please see how to reset basis image in the README."
+            )
+
+    def _set_roi_size(self):
+        """The cropped ROI is shrunk by the same factor as resizing the
+        whole video to downsize_height would, so the slices match those
+        from the re-encoded _small.mp4. Registration is still done on the
+        full size frame.
+        """
+        self.size = None
+        if self.downsize:
+            scale = self.downsize_height / self.frame_100.shape[0]
+            self.size = (max(round(self.W * scale), 1), max(round(self.H * scale), 1))
+
+    def _roi_shape(self) -> Tuple[int, int]:
+        """Width and height of cropped frames"""
+        return self.size if self.size is not None else (self.W, self.H)
+
+    def _pipeline_main(self, cropped_vid: Optional[str]) -> List[np.array]:
+        """Slice every frame of the video, returning one row
+        for each group of slice_freq frames. Rows are checkpointed every
+        checkpoint_every rows, so an interrupted run can be resumed. The
+        cropped video of a resumed run only starts from the checkpoint,
+        so it is written to a separate file rather than replacing the
+        full video of an earlier run.
+        """
+
+        # pick up from the last checkpoint of an interrupted run
+        rows, start = self._load_checkpoint()
+
+        # rewind the shared capture, or reopen if it can't seek
+        cap = self._capture()
+        if not cap.set(cv2.CAP_PROP_POS_FRAMES, 0):
+            self._release()
+            cap = self._capture()
+        if start and not seek_frame(cap, start):
+            raise Exception(f"Error seeking to frame {start} in {self.video_path}")
+        if start and cropped_vid is not None:
+            cropped_vid = _partial_name(cropped_vid, start)
+            print(
+                f"Resuming from frame {start}, the cropped video is only saved "
+                f"from there, to {cropped_vid}"
+            )
 
         # Some characteristics from the original video
         self.fps, _ = cap.get(cv2.CAP_PROP_FPS), cap.get(cv2.CAP_PROP_FRAME_COUNT)
 
-        # output
+        # decode in a background thread so that reading the next
+        # frames overlaps with slicing the current one
+        frames = TimedQueue(maxsize=self.queue_size)
+        self._decode_error = None
+        stop = threading.Event()
+        decoder = threading.Thread(
+            target=self._decode_frames,
+            name="FrameDecoder",
+            args=(cap, frames, stop),
+            daemon=True,
+        )
+        decoder.start()
+
+        # encode the cropped video in its own thread, if it is wanted
+        encoder, to_encode = None, None
+        if cropped_vid is not None:
+            to_encode = TimedQueue(maxsize=self.queue_size)
+            encoder = threading.Thread(
+                target=_encode_frames,
+                name="FrameEncoder",
+                args=(self._init_vidwriter(cropped_vid), to_encode),
+                daemon=True,
+            )
+            encoder.start()
+
+        # slice frames in blocks and average as they arrive,
+        # keeping one row per group
+        width, height = self._roi_shape()
+        reducer = SliceReducer(
+            height, width, self.slice_freq, self.remainder, self.batch_size
+        )
+        saved = len(rows)
+        try:
+            while True:
+                crop_frame = frames.get()
+
+                # decoder sends None when the video is finished
+                if crop_frame is None:
+                    break
+
+                rows.extend(reducer.add(crop_frame))
+                if to_encode is not None:
+                    to_encode.put(crop_frame)
+
+                if self.checkpoint_every and len(rows) - saved >= self.checkpoint_every:
+                    self._save_checkpoint(rows)
+                    saved = len(rows)
+        finally:
+            if encoder is not None:
+                to_encode.put(None)
+                encoder.join()
+
+            # if slicing failed the decoder may be waiting on a full queue
+            stop.set()
+            _drain(frames)
+            decoder.join()
+            self._release()
+
+        if self._decode_error is not None:
+            raise self._decode_error
+
+        # slice the last block, and deal with frames after the last full group
+        rows.extend(reducer.finish())
+
+        self._report_queue_stats(frames, to_encode)
+        self._remove_checkpoint()
+
+        return rows
+
+    def _checkpoint_path(self) -> Optional[str]:
+        """Checkpoints are kept in the cache folder (so they survive the
+        results folder being renamed), under a key made from everything
+        that changes the sliced rows.
+        """
+        if self.cache_dir is None or not self.checkpoint_every:
+            return None
+        key = hash_key(
+            fingerprint_file(self.video_path),
+            (self.X, self.Y, self.W, self.H),
+            self.size,
+            self.slice_freq,
+            self.remainder,
+        )
+        folder = check_dir_make(f"{self.cache_dir}{os.sep}checkpoints")
+        return f"{folder}{os.sep}{key}.npz"
+
+    def _load_checkpoint(self) -> Tuple[List[np.array], int]:
+        """Rows saved by an interrupted run with the same inputs, and the
+        frame to carry on from. Rows are only saved for complete groups,
+        so the run carries on from the start of the next group.
+        """
+        self.resumed_from = 0
+        self._ckpt = path = self._checkpoint_path()
+        if path is None or not os.path.exists(path):
+            return [], 0
+
+        with np.load(path) as ckpt:
+            rows, frame = list(ckpt["rows"]), int(ckpt["frame"])
+        print(f"Resuming from checkpoint at frame {frame}")
+        self.resumed_from = frame
+        return rows, frame
+
+    def _save_checkpoint(self, rows: List[np.array]):
+        tmp = f"{self._ckpt}.tmp"
+        with open(tmp, "wb") as fp:
+            np.savez(fp, rows=np.stack(rows, axis=0), frame=len(rows) * self.slice_freq)
+        os.replace(tmp, self._ckpt)
+
+    def _remove_checkpoint(self):
+        if self._ckpt is not None and os.path.exists(self._ckpt):
+            os.remove(self._ckpt)
+
+    def _init_vidwriter(self, cropped_vid: str) -> cv2.VideoWriter:
+        """Create writer for the cropped result video"""
         fourcc = cv2.VideoWriter_fourcc(*"mp4v")
-
-        out = cv2.VideoWriter(
+        return cv2.VideoWriter(
             f"{self.out_folder}{os.sep}{cropped_vid}",
             fourcc,
             self.fps,
-            (self.W, self.H),
+            self._roi_shape(),
         )
 
-        slices = []
+    def _decode_frames(
+        self,
+        cap: cv2.VideoCapture,
+        frames: TimedQueue,
+        stop: threading.Event = None,
+    ):
+        """Read and crop frames from the video, feeding them into the
+        bounded frame queue until the video ends or stop is set. Finishes
+        with None so that the consumer knows to stop.
+        """
+        stop = threading.Event() if stop is None else stop
+        try:
+            while cap.isOpened():
+                ret, frame = cap.read()
+
+                # Avoid problems when video finish
+                if not ret:
+                    break
+
+                crop = _crop(frame, (self.X, self.Y, self.W, self.H), self.size)
+
+                # queue a copy, as a view would keep the whole frame alive
+                # while it waits (and again in the encode queue)
+                if not _put_until(
+                    frames, crop.copy() if crop.base is not None else crop, stop
+                ):
+                    break
+        except Exception as e:
+            self._decode_error = e
+        finally:
+            _put_until(frames, None, stop)
+
+    def _report_queue_stats(
+        self, frames: TimedQueue, to_encode: Optional[TimedQueue] = None
+    ):
+        """Record and print how long each stage spent blocked on its
+        queue. A decode stage that is always blocked means the reduction
+        is the bottleneck, and vice versa. Time blocked on the encode queue
+        is time that slicing waited for the video encoder.
+        """
+        self.queue_stats = {
+            "decode_blocked": frames.put_wait,
+            "reduce_blocked": frames.get_wait,
+        }
+        if to_encode is not None:
+            self.queue_stats["encode_blocked"] = to_encode.put_wait
+
+        print(
+            "Frame queues: "
+            + ", ".join(f"{k} {v:.2f}s" for k, v in self.queue_stats.items())
+        )
 
-        # Now we start
-        while cap.isOpened():
-            ret, frame = cap.read()
+    def _pipeline_parallel(self) -> np.array:
+        """Split the frame range into one chunk per job, with chunk edges
+        on multiples of slice_freq, and slice each chunk in a separate
+        process. Each chunk is averaged into groups on its own, and chunks
+        are merged in order so the result is the same as reading the video
+        front to back. The cropped video is not written in this mode.
+        """
+        cap = self._capture()
+        self.fps = cap.get(cv2.CAP_PROP_FPS)
+        n_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self._release()
+
+        print(f"Slicing video in {self.jobs} chunks")
+
+        bounds = _chunk_bounds(n_frames, self.jobs, self.slice_freq)
+        roi = (self.X, self.Y, self.W, self.H)
+        with ProcessPoolExecutor(max_workers=self.jobs) as pool:
+            chunks = pool.map(
+                _slice_chunk,
+                repeat(self.video_path),
+                [b[0] for b in bounds],
+                [b[1] for b in bounds],
+                repeat(roi),
+                repeat(self.size),
+                repeat(self.slice_freq),
+                repeat(self.remainder),
+                repeat(self.batch_size),
+            )
+            return np.concatenate(list(chunks), axis=0)
+
+    def _stack_and_save(self, rows: List[np.array]) -> str:
+        height = self._roi_shape()[1]
+        sliced = np.stack(rows, axis=0) if len(rows) else np.empty((0, height))
+        meta = self._metadata(sliced)
+        self._store_cached_sliced(sliced, meta)
+        return save_sliced(f"{self.out_folder}{os.sep}{self.filename}", sliced, meta)
+
+    def _sliced_cache(self) -> Tuple[Optional[DiskCache], Optional[str]]:
+        """Sliced data only depends on the video, the basis image, the
+        input dims and the slicing settings, so it is cached under a key
+        made from those. Changing anything used by HistogramPipeline
+        (window, smoothing, time correction, calibration) still hits.
+        """
+        if not self.cache_sliced:
+            return None, None
+
+        key = hash_key(
+            fingerprint_file(self.video_path),
+            hash_file(self.basis),
+            (self.X, self.Y, self.W, self.H),
+            self.slice_freq,
+            self.remainder,
+            self.downsize,
+            self.downsize_mode,
+            self.downsize_height,
+        )
+        cache = DiskCache(
+            f"{self.cache_dir}{os.sep}sliced",
+            max_bytes=int(ENV.SLICED_CACHE_MB) * 2**20,
+        )
+        return cache, key
+
+    def _load_cached_sliced(self) -> Optional[str]:
+        # key is made before registration changes the dims
+        self._sliced = cache, key = self._sliced_cache()
+        if cache is None:
+            return None
+
+        entry = cache.get(key)
+        if entry is None:
+            return None
+
+        print("Using cached sliced data, the video is not processed")
+        data = f"{entry}{os.sep}sliced.npy"
+        meta = load_meta(data)
+        self.fps = meta["fps"]
+        self.X, self.Y, self.W, self.H = meta["roi"]
+        self.homography = np.array(meta["homography"])
+        return save_sliced(
+            f"{self.out_folder}{os.sep}{self.filename}",
+            load_sliced(data, mmap=False),
+            meta,
+        )
 
-            # Avoid problems when video finish
-            if ret:
+    def _store_cached_sliced(self, sliced: np.array, meta: dict):
+        cache, key = self._sliced
+        if cache is None:
+            return
+        with tempfile.TemporaryDirectory() as tmp:
+            data = save_sliced(f"{tmp}{os.sep}sliced.npy", sliced, meta)
+            cache.put(
+                key,
+                {"sliced.npy": data, "sliced.json": meta_path(data)},
+            )
+
+    def _metadata(self, sliced: np.array) -> dict:
+        """Everything needed to interpret the sliced data later, saved
+        alongside it. The background is precomputed with the default
+        window, so it doesn't need to be read from the data again.
+        """
+        nframes_back = int(100 / self.slice_freq)
+        window = (int(ENV.WIN_TOP), int(ENV.WIN_BOTTOM))
+        return {
+            "video": self.video_path,
+            "fps": self.fps,
+            "slice_freq": self.slice_freq,
+            "remainder": self.remainder,
+            "roi": [self.X, self.Y, self.W, self.H],
+            "size": list(self._roi_shape()),
+            "homography": self.homography.tolist(),
+            "background": {
+                "value": compute_background(sliced, nframes_back, window)
+                if len(sliced)
+                else None,
+                "nframes": nframes_back,
+                "window": list(window),
+            },
+        }
+
+
+def norm_image(image: np.ndarray, code: int = cv2.COLOR_BGR2GRAY) -> np.ndarray:
+    """Grayscale, blurred copy of image used for registration"""
+    return cv2.GaussianBlur(
+        cv2.cvtColor(image, code),
+        ksize=(3, 3),
+        sigmaX=3,
+        sigmaY=3,
+    )
+
+
+def orb_features(image: np.ndarray, max_features: int = MAX_FEATURES) -> tuple:
+    """ORB keypoints and descriptors of a normed image"""
+    orb = cv2.ORB_create(max_features)
+    return orb.detectAndCompute(image, None)
+
+
+def match_features(
+    features_new: tuple,
+    features_basis: tuple,
+    good_match_percent: float = GOOD_MATCH_PERCENT,
+) -> list:
+    """Best matches between the features of two images, best first"""
+    descriptors1, descriptors2 = features_new[1], features_basis[1]
+    if descriptors1 is None or descriptors2 is None:
+        return []
+
+    matcher = cv2.DescriptorMatcher_create(cv2.DESCRIPTOR_MATCHER_BRUTEFORCE_HAMMING)
+    matches = list(matcher.match(descriptors1, descriptors2, None))
+
+    # Sort matches by score
+    matches.sort(key=lambda x: x.distance, reverse=False)
+
+    # Remove not so good matches
+    numGoodMatches = int(len(matches) * good_match_percent)
+    return matches[:numGoodMatches]
+
+
+def find_homography(
+    features_new: tuple, features_basis: tuple, matches: list
+) -> Optional[np.ndarray]:
+    """Homography from the new image to the basis, from matched features,
+    or None if there are too few matches to find one.
+    """
+    if len(matches) < 4:
+        return None
+
+    # Extract location of good matches
+    points1 = np.zeros((len(matches), 2), dtype=np.float32)
+    points2 = np.zeros((len(matches), 2), dtype=np.float32)
+
+    for i, match in enumerate(matches):
+        points1[i, :] = features_new[0][match.queryIdx].pt
+        points2[i, :] = features_basis[0][match.trainIdx].pt
+
+    # Find homography
+    homography, _ = cv2.findHomography(points1, points2, cv2.RANSAC)
+    return homography
 
-                crop_frame = frame[
-                    self.Y : self.Y + self.H, self.X : self.X + self.W, :
-                ]
-                slices.append(frame_to_slice(crop_frame))
-                out.write(crop_frame)
-            else:
-                break
 
-        cap.release()
-        out.release()
+def frame_to_slice(frame: np.ndarray) -> np.ndarray:
+    # uint8 frames straight from the video use the integer kernel
+    if frame.dtype == np.uint8:
+        return frames_to_slices(frame[np.newaxis])[0]
+    _imageGREY = frame.mean(axis=2)
+    return _imageGREY.mean(axis=1)
 
-        return slices
 
-    def _stack_and_save(self, slices: List[np.array]) -> str:
-        sliced = np.stack(slices, axis=0)
-        sliced = _grouped_avg(sliced)
-        np.savetxt(f"{self.out_folder}{os.sep}{self.filename}", sliced, delimiter=",")
-        return f"{self.out_folder}{os.sep}{self.filename}"
+def frames_to_slices(frames: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+    """Mean of each row for a block of K cropped uint8 frames, shape
+    (K, H, W, 3), returning shape (K, H). Rows are summed as 32-bit
+    integers straight from the uint8 data, so no float copy of the
+    frames is made. Same result as frame_to_slice on each frame, to
+    within float rounding. Results are written to out if given.
+    """
+    K, H, W, C = frames.shape
+    if frames.flags.c_contiguous:
+        sums = cv2.reduce(
+            frames.reshape(K * H, W * C), 1, cv2.REDUCE_SUM, dtype=cv2.CV_32S
+        ).reshape(K, H)
+    else:
+        sums = frames.sum(axis=(2, 3), dtype=np.uint32)
+    return np.divide(sums, W * C, out=out)
+
+
+def _encode_frames(out: cv2.VideoWriter, to_encode: TimedQueue):
+    """Write cropped frames to the result video until None is received.
+    Runs in its own thread so that encoding does not hold up slicing.
+    """
+    try:
+        while True:
+            frame = to_encode.get()
+            if frame is None:
+                break
+            out.write(frame)
+    finally:
+        out.release()
 
 
-def frame_to_slice(frame: np.ndarray) -> np.ndarray:
-    _imageGREY = frame.mean(axis=2)
-    return _imageGREY.mean(axis=1)
+def _put_until(frames: TimedQueue, item, stop: threading.Event) -> bool:
+    """Put item in frames, waiting for space until stop is set. Returns
+    False if it was stopped first.
+    """
+    while not stop.is_set():
+        try:
+            frames.put(item, timeout=DECODE_POLL)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _drain(frames: TimedQueue):
+    """Empty frames without waiting"""
+    while True:
+        try:
+            frames.get_nowait()
+        except queue.Empty:
+            return
+
+
+def _partial_name(cropped_vid: str, start: int) -> str:
+    """Name of a cropped video that starts at frame start"""
+    stem, ext = os.path.splitext(cropped_vid)
+    return f"{stem}_from_{start}{ext}"
+
+
+def _chunk_bounds(
+    n_frames: int, n_chunks: int, slice_freq: int
+) -> List[Tuple[int, Optional[int]]]:
+    """Split n_frames into at most n_chunks (start, stop) ranges, with all
+    edges on a multiple of slice_freq so no group of frames is split
+    between two chunks. The last chunk has no stop, so it reads to the
+    end of the video even if the frame count reported by OpenCV is off.
+    """
+    n_groups = max(n_frames // slice_freq, 1)
+    edges = sorted(
+        {round(i * n_groups / n_chunks) * slice_freq for i in range(n_chunks)}
+    )
+    return list(zip(edges, edges[1:] + [None]))
+
+
+def _crop(
+    frame: np.ndarray,
+    roi: Tuple[int, int, int, int],
+    size: Optional[Tuple[int, int]] = None,
+) -> np.ndarray:
+    """Crop ROI (X, Y, W, H) from frame, shrinking it to size if given"""
+    X, Y, W, H = roi
+    crop = frame[Y : Y + H, X : X + W, :]
+    if size is not None:
+        crop = cv2.resize(crop, size, interpolation=cv2.INTER_AREA)
+    return crop
+
+
+def _clip_roi(
+    roi: Tuple[int, int, int, int], shape: tuple
+) -> Tuple[int, int, int, int]:
+    """Part of ROI (X, Y, W, H) inside a frame of shape"""
+    X, Y, W, H = roi
+    height, width = shape[:2]
+    left, top = min(max(X, 0), width), min(max(Y, 0), height)
+    right, bottom = min(max(X + W, left), width), min(max(Y + H, top), height)
+    return int(left), int(top), int(right - left), int(bottom - top)
+
+
+def _slice_chunk(
+    video_path: str,
+    start: int,
+    stop: Optional[int],
+    roi: Tuple[int, int, int, int],
+    size: Optional[Tuple[int, int]],
+    slice_freq: int,
+    remainder: str,
+    batch_size: int,
+) -> np.array:
+    """Worker for parallel slicing - seek to start frame, and slice each
+    frame until stop (or the end of the video), averaging into groups.
+    """
+    W, H = size if size is not None else roi[2:]
+    cap = cv2.VideoCapture(video_path)
+
+    # an inexact seek would overlap or skip frames at the chunk edges
+    if start and not seek_frame(cap, start):
+        cap.release()
+        raise Exception(f"Error seeking to frame {start} of {video_path}")
+
+    reducer = SliceReducer(H, W, slice_freq, remainder, batch_size)
+    rows = []
+    index = start
+    while stop is None or index < stop:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        rows.extend(reducer.add(_crop(frame, roi, size)))
+        index += 1
+    cap.release()
+
+    rows.extend(reducer.finish())
+
+    if not rows:
+        return np.empty((0, H))
+    return np.stack(rows, axis=0)
+
+
+class SliceReducer:
+    """Copy cropped frames into a preallocated uint8 block, and once
+    the block is full slice all of it with frames_to_slices, passing
+    the slices on to a GroupedAverage.
+
+    Args:
+        height: height of cropped frames (ROI)
+        width: width of cropped frames (ROI)
+        slice_freq: number of slices to average into each row
+        remainder: see GroupedAverage
+        batch_size: number of frames sliced at once
+    """
+
+    def __init__(
+        self,
+        height: int,
+        width: int,
+        slice_freq: int,
+        remainder: str = "drop",
+        batch_size: int = 32,
+    ):
+        self.averager = GroupedAverage(height, slice_freq, remainder)
+        self._block = np.empty((batch_size, height, width, 3), dtype=np.uint8)
+        self._slices = np.empty((batch_size, height))
+        self._n = 0
+
+    def add(self, frame: np.ndarray) -> List[np.array]:
+        """Add one cropped frame, returning any group
+        averages completed by slicing the block.
+        """
+        self._block[self._n] = frame
+        self._n += 1
+        if self._n == len(self._block):
+            return self._flush()
+        return []
+
+    def finish(self) -> List[np.array]:
+        """Slice the partial block left at the end of the video"""
+        rows = self._flush()
+        row = self.averager.finish()
+        if row is not None:
+            rows.append(row)
+        return rows
+
+    def _flush(self) -> List[np.array]:
+        n, self._n = self._n, 0
+        if n == 0:
+            return []
+        slices = frames_to_slices(self._block[:n], out=self._slices[:n])
+        rows = []
+        for _slice in slices:
+            row = self.averager.add(_slice)
+            if row is not None:
+                rows.append(row)
+        return rows
+
+
+class GroupedAverage:
+    """Streaming replacement for _grouped_avg. Slices are summed into a
+    buffer the height of the ROI, and the average is returned every time
+    slice_freq slices have been added, so memory stays constant however
+    long the video is. Each group is summed from zero, which avoids the
+    precision lost by a cumulative sum over the whole video.
+
+    Args:
+        height: number of rows in each slice (height of ROI)
+        slice_freq: number of slices to average into each row
+        remainder: what to do with the slices left after the last full
+            group - "drop" discards them (as _grouped_avg does), "keep"
+            averages them into one last, smaller group
+    """
+
+    REMAINDERS = ("drop", "keep")
+
+    def __init__(self, height: int, slice_freq: int, remainder: str = "drop"):
+        if remainder not in self.REMAINDERS:
+            raise ValueError(
+                f"Unknown remainder {remainder}, use one of {self.REMAINDERS}"
+            )
+        self.slice_freq = slice_freq
+        self.remainder = remainder
+        self._sum = np.zeros(height)
+        self._count = 0
+
+    def add(self, row: np.array) -> Optional[np.array]:
+        """Add one slice, returning the group average if
+        this slice completes a group, else None.
+        """
+        self._sum += row
+        self._count += 1
+        if self._count == self.slice_freq:
+            return self._emit()
+        return None
+
+    def finish(self) -> Optional[np.array]:
+        """Deal with the incomplete group at the end of the video"""
+        if self._count and self.remainder == "keep":
+            return self._emit()
+        self._reset()
+        return None
+
+    def _emit(self) -> np.array:
+        row = self._sum / self._count
+        self._reset()
+        return row
+
+    def _reset(self):
+        self._sum[:] = 0
+        self._count = 0
 
 
 def _grouped_avg(myArray: np.array, slice_freq: int = int(ENV.SLICE_FREQ)) -> np.array:
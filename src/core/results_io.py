@@ -0,0 +1,90 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+FORMATS = {
+    "xlsx": ".xlsx",
+    "csv": ".csv",
+    "parquet": ".parquet",
+    "feather": ".feather",
+    "npz": ".npz",
+}
+
+
+def results_path(path: str, fmt: str) -> str:
+    """Change the extension of path to match the results format"""
+    if fmt not in FORMATS:
+        raise ValueError(f"Results format {fmt} not one of {', '.join(FORMATS)}")
+    return f"{os.path.splitext(path)[0]}{FORMATS[fmt]}"
+
+
+def results_format(path: str) -> str:
+    """Format of a results file, from its extension"""
+    ext = os.path.splitext(path)[1].lower()
+    for fmt, _ext in FORMATS.items():
+        if ext == _ext:
+            return fmt
+    raise ValueError(f"Results file {path} is not one of {', '.join(FORMATS)}")
+
+
+def save_results(df: pd.DataFrame, path: str) -> str:
+    """Save a table of results in the format given by the extension of
+    path. csv, parquet, feather and npz are much faster to write and read
+    than xlsx, which can be made later with export_xlsx. parquet and
+    feather need pyarrow to be installed.
+    """
+    fmt = results_format(path)
+    if fmt == "xlsx":
+        df.to_excel(path, index=False)
+    elif fmt == "csv":
+        df.to_csv(path, index=False)
+    elif fmt == "npz":
+        # column names aren't valid file names in the archive, so keep
+        # them alongside the data rather than as keys
+        np.savez(
+            path, data=df.values.astype(float), columns=np.array(df.columns, dtype=str)
+        )
+    else:
+        _check_pyarrow(fmt)
+        if fmt == "parquet":
+            df.to_parquet(path, index=False)
+        else:
+            df.reset_index(drop=True).to_feather(path)
+    return path
+
+
+def load_results(path: str) -> pd.DataFrame:
+    """Read a table of results saved with save_results"""
+    fmt = results_format(path)
+    if fmt == "xlsx":
+        return pd.read_excel(path)
+    elif fmt == "csv":
+        return pd.read_csv(path)
+    elif fmt == "npz":
+        with np.load(path) as npz:
+            return pd.DataFrame(npz["data"], columns=npz["columns"])
+    _check_pyarrow(fmt)
+    if fmt == "parquet":
+        return pd.read_parquet(path)
+    return pd.read_feather(path)
+
+
+def export_xlsx(path: str) -> str:
+    """Write an xlsx copy of results saved in one of the fast formats,
+    next to the original, for when it is needed to read by hand.
+    """
+    xlsx = results_path(path, "xlsx")
+    if xlsx != path:
+        load_results(path).to_excel(xlsx, index=False)
+    return xlsx
+
+
+def _check_pyarrow(fmt: str):
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        raise Exception(
+            f"Saving results as {fmt} needs pyarrow, install it with "
+            "pip install pyarrow, or use csv or npz instead"
+        )
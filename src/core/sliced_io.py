@@ -0,0 +1,56 @@
+import json
+import os
+
+import numpy as np
+
+
+def save_sliced(path: str, sliced: np.array, meta: dict = None) -> str:
+    """Save sliced brightness data. Files ending in .csv are written as
+    text like older versions, anything else as .npy, which is much faster
+    to read and can be memory-mapped. Metadata (fps, slice_freq, ROI,
+    homography, background...) is saved next to it in a .json sidecar.
+    """
+    if path.endswith(".csv"):
+        np.savetxt(path, sliced, delimiter=",")
+    else:
+        # np.save adds .npy if it is missing, so write to a handle
+        with open(path, "wb") as fp:
+            np.save(fp, sliced)
+
+    if meta is not None:
+        with open(meta_path(path), "w") as fp:
+            json.dump(meta, fp, indent=2)
+
+    return path
+
+
+def load_sliced(path: str, mmap: bool = True) -> np.array:
+    """Load sliced brightness data from either .npy or legacy .csv. The
+    .npy data is memory-mapped by default, so only the columns that are
+    used get read from disk.
+    """
+    if path.endswith(".csv"):
+        return np.loadtxt(path, delimiter=",")
+    return np.load(path, mmap_mode="r" if mmap else None)
+
+
+def load_meta(path: str) -> dict:
+    """Metadata saved alongside sliced data, or an
+    empty dictionary for files without a sidecar.
+    """
+    if not os.path.exists(meta_path(path)):
+        return {}
+    with open(meta_path(path), "r") as fp:
+        return json.load(fp)
+
+
+def meta_path(path: str) -> str:
+    return f"{os.path.splitext(path)[0]}.json"
+
+
+def compute_background(sliced: np.array, nframes_back: int, window: tuple) -> float:
+    """Average brightness of the window over the first nframes_back
+    rows, which is subtracted from the data as background.
+    """
+    means = sliced[:, window[0] : window[1]].mean(axis=1)
+    return float(np.mean(means[:nframes_back]))
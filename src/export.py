@@ -0,0 +1,31 @@
+import os
+
+import click
+
+from src.config import ENV
+from src.core.results_io import FORMATS, export_xlsx
+
+
+@click.command()
+@click.option(
+    "-i",
+    "inlet",
+    prompt=False,
+    help="Folder to search for results saved as csv, parquet, feather or npz",
+    type=click.Path(exists=True),
+)
+def main(inlet):
+    """Write an xlsx copy of every results file in the folder (and its
+    sub-folders) that was saved in one of the fast formats.
+    """
+    stem = os.path.splitext(ENV.RESULTS_DATA)[0]
+    fast = tuple(ext for fmt, ext in FORMATS.items() if fmt != "xlsx")
+    for root, _, files in os.walk(inlet):
+        for f in sorted(files):
+            name, ext = os.path.splitext(f)
+            if name.endswith(stem) and ext in fast:
+                print(f"Exporting {export_xlsx(f'{root}{os.sep}{f}')}")
+
+
+if __name__ == "__main__":
+    main()
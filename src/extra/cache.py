@@ -0,0 +1,122 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from typing import Optional
+
+from src.extra.tools import check_dir_make
+
+
+class DiskCache:
+    """Folder of cached results, with one sub-folder per key. Entries
+    are evicted least recently used first, once there are more than
+    max_entries or the cache takes more than max_bytes on disk.
+
+    Args:
+        folder: folder to keep the cache in
+        max_entries: maximum number of entries, or None for no limit
+        max_bytes: maximum total size of entries, or None for no limit
+    """
+
+    def __init__(
+        self,
+        folder: str,
+        max_entries: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+    ):
+        self.folder = check_dir_make(folder)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the folder of the entry for key, or None if
+        there is no entry. Marks the entry as recently used.
+        """
+        path = f"{self.folder}{os.sep}{key}"
+        if not os.path.isdir(path):
+            return None
+        os.utime(path)
+        return path
+
+    def put(self, key: str, files: dict) -> str:
+        """Add entry for key, copying files (dict of name in cache: path
+        to copy from) into it. The entry is built in a temporary folder
+        and renamed into place, so readers never see half an entry.
+        """
+        tmp = tempfile.mkdtemp(dir=self.folder, prefix=".tmp_")
+        for name, src in files.items():
+            shutil.copyfile(src, f"{tmp}{os.sep}{name}")
+        return self._commit(key, tmp)
+
+    def get_json(self, key: str, name: str = "data.json") -> Optional[dict]:
+        path = self.get(key)
+        if path is None or not os.path.exists(f"{path}{os.sep}{name}"):
+            return None
+        with open(f"{path}{os.sep}{name}", "r") as fp:
+            return json.load(fp)
+
+    def put_json(self, key: str, data: dict, name: str = "data.json") -> str:
+        tmp = tempfile.mkdtemp(dir=self.folder, prefix=".tmp_")
+        with open(f"{tmp}{os.sep}{name}", "w") as fp:
+            json.dump(data, fp)
+        return self._commit(key, tmp)
+
+    def _commit(self, key: str, tmp: str) -> str:
+        path = f"{self.folder}{os.sep}{key}"
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        try:
+            os.replace(tmp, path)
+        except OSError:
+            # another process added the same entry first
+            shutil.rmtree(tmp, ignore_errors=True)
+        self._evict()
+        return path
+
+    def _evict(self):
+        """Remove least recently used entries until within limits"""
+        entries = []
+        for key in os.listdir(self.folder):
+            path = f"{self.folder}{os.sep}{key}"
+            if key.startswith(".tmp_") or not os.path.isdir(path):
+                continue
+            size = sum(os.path.getsize(f"{path}{os.sep}{f}") for f in os.listdir(path))
+            entries.append((os.path.getmtime(path), size, path))
+        entries.sort()
+
+        total = sum(e[1] for e in entries)
+        while entries and (
+            (self.max_entries is not None and len(entries) > self.max_entries)
+            or (self.max_bytes is not None and total > self.max_bytes)
+        ):
+            _, size, path = entries.pop(0)
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+
+def hash_file(path: str, chunk: int = 1 << 20) -> str:
+    """sha1 of the contents of a file"""
+    sha = hashlib.sha1()
+    with open(path, "rb") as fp:
+        for block in iter(lambda: fp.read(chunk), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def fingerprint_file(path: str, sample: int = 1 << 20) -> str:
+    """Fast fingerprint of a large file, from its size and samples
+    from the start, middle and end, rather than hashing all of it.
+    """
+    size = os.path.getsize(path)
+    sha = hashlib.sha1(str(size).encode())
+    with open(path, "rb") as fp:
+        for offset in (0, max(size // 2 - sample // 2, 0), max(size - sample, 0)):
+            fp.seek(offset)
+            sha.update(fp.read(sample))
+    return sha.hexdigest()
+
+
+def hash_key(*parts) -> str:
+    """Combine parts (anything with a stable str) into one key"""
+    return hashlib.sha1("|".join(str(p) for p in parts).encode()).hexdigest()
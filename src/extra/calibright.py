@@ -9,6 +9,8 @@ import pandas as pd
 from matplotlib.lines import Line2D
 from sklearn.linear_model import LinearRegression
 
+from src.core.results_io import FORMATS, load_results
+
 COLORS = list(mcolors.BASE_COLORS.keys())
 
 
@@ -36,11 +38,16 @@ def gen_df(path: Path) -> Tuple[pd.DataFrame, str]:
 
 
 def _read_data(path: Path) -> dict:
-    """Read in all xlsx files from path and return as dictionary"""
+    """Read in all results files (xlsx or any of the faster formats)
+    from path and return as dictionary. If the same results are saved
+    in more than one format, the xlsx copy is not read.
+    """
     data = {}
-    csv_list = [path / f for f in os.listdir(path) if ".xlsx" in f]
-    for csv in csv_list:
-        data[csv.stem] = pd.read_excel(csv)
+    exts = FORMATS.values()
+    res_list = [path / f for f in os.listdir(path) if Path(f).suffix in exts]
+    for res in sorted(res_list, key=lambda f: (f.stem, f.suffix == ".xlsx")):
+        if res.stem not in data:
+            data[res.stem] = load_results(str(res))
     return data
 
 
@@ -0,0 +1,176 @@
+import queue
+import threading
+import time
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List
+
+
+class TimedQueue(queue.Queue):
+    """Bounded queue that records how long producers spent blocked
+    on a full queue and how long consumers spent blocked on an empty
+    one. Used to see which stage of a threaded pipeline is the
+    bottleneck.
+    """
+
+    def __init__(self, maxsize: int = 0):
+        super().__init__(maxsize)
+        self.put_wait = 0.0
+        self.get_wait = 0.0
+
+    def put(self, item, block: bool = True, timeout: float = None):
+        start = time.perf_counter()
+        try:
+            super().put(item, block, timeout)
+        finally:
+            self.put_wait += time.perf_counter() - start
+
+    def get(self, block: bool = True, timeout: float = None):
+        start = time.perf_counter()
+        item = super().get(block, timeout)
+        self.get_wait += time.perf_counter() - start
+        return item
+
+
+class BackgroundWorker:
+    """Run jobs one at a time in a background thread, so that slow,
+    non-critical work (e.g. rendering plots) doesn't hold up the next
+    video. wait() blocks until all jobs are done and raises the first
+    error. With background False, jobs are run right away instead.
+    """
+
+    def __init__(self, background: bool = True):
+        self._pool = ThreadPoolExecutor(max_workers=1) if background else None
+        self._futures: List[Future] = []
+
+    def submit(self, fn, *args, **kwargs):
+        if self._pool is None:
+            fn(*args, **kwargs)
+        else:
+            self._futures.append(self._pool.submit(fn, *args, **kwargs))
+
+    def wait(self):
+        futures, self._futures = self._futures, []
+        for future in futures:
+            future.result()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        try:
+            # don't hide an error that is already being raised
+            if exc_type is None:
+                self.wait()
+        finally:
+            if self._pool is not None:
+                self._pool.shutdown()
+
+
+class QueueWorker:
+    """Long-lived thread that calls handler on each item put in its
+    bounded queue, in order. When the queue is full, policy decides what
+    happens: block waits for space (back-pressure), newest drops the item
+    being added, oldest drops the item that has waited longest to make
+    room. Dropped items and the deepest the queue got are counted. With
+    batch above 1, handler is called with a list of up to batch items,
+    all those waiting when it is ready for more.
+
+    Args:
+        handler: function called with each item (or list of items)
+        maxsize: number of items that can wait in the queue
+        policy: block, newest or oldest
+        name: name of the thread
+        batch: maximum number of items passed to handler at once
+    """
+
+    POLICIES = ("block", "newest", "oldest")
+    _STOP = object()
+
+    def __init__(
+        self,
+        handler,
+        maxsize: int,
+        policy: str = "oldest",
+        name: str = None,
+        batch: int = 1,
+    ):
+        if policy not in self.POLICIES:
+            raise ValueError(
+                f"Drop policy {policy} not one of {', '.join(self.POLICIES)}"
+            )
+        self.handler = handler
+        self.policy = policy
+        self.batch = batch
+        self.queue = TimedQueue(maxsize)
+        self.dropped = 0
+        self.processed = 0
+        self.max_depth = 0
+        self.error = None
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def put(self, item) -> bool:
+        """Add item to the queue, returns False if an item was dropped"""
+        kept = True
+        if self.policy == "block":
+            self.queue.put(item)
+        elif self.policy == "newest":
+            try:
+                self.queue.put_nowait(item)
+            except queue.Full:
+                self.dropped += 1
+                kept = False
+        else:
+            while True:
+                try:
+                    self.queue.put_nowait(item)
+                    break
+                except queue.Full:
+                    try:
+                        self.queue.get_nowait()
+                        self.dropped += 1
+                        kept = False
+                    except queue.Empty:
+                        pass
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+        return kept
+
+    def stats(self) -> dict:
+        return {
+            "depth": self.queue.qsize(),
+            "max_depth": self.max_depth,
+            "processed": self.processed,
+            "dropped": self.dropped,
+        }
+
+    def close(self, timeout: float = None):
+        """Finish the items already queued, then stop the thread"""
+        self.queue.put(self._STOP)
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            items = [self.queue.get()]
+            while len(items) < self.batch and items[-1] is not self._STOP:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = items[-1] is self._STOP
+            if stop:
+                items.pop()
+            if items:
+                self._handle(items if self.batch > 1 else items[0])
+                self.processed += len(items)
+            if stop:
+                return
+
+    def _handle(self, item):
+        try:
+            self.handler(item)
+        except Exception as e:
+            # keep going, a bad item shouldn't stop a live session
+            self.error = e
+            traceback.print_exc()
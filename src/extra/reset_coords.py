@@ -2,6 +2,7 @@ import os
 
 import cv2
 import numpy as np
+from src.extra.tools import read_frame
 
 
 class BoundingBoxWidget(object):
@@ -106,10 +107,10 @@ def get_basis_image(basis_video) -> np.array:
     vidcap = cv2.VideoCapture(basis_video)
     # take 100th frame to avoid issues with reading
     # first frame
-    for _ in range(100):
-        success, vid = vidcap.read()
+    success, vid = read_frame(vidcap, 99)
+    vidcap.release()
     if not success:
-        raise Exception(f"Error reading 10th frame from path {basis_video}")
+        raise Exception(f"Error reading 100th frame from path {basis_video}")
     return vid
 
 
@@ -1,7 +1,43 @@
 import os
+from typing import Tuple
+
+import cv2
+import numpy as np
 
 
 def check_dir_make(path: str):
     if not os.path.exists(path):
         os.makedirs(path)
     return path
+
+
+def read_frame(cap: cv2.VideoCapture, index: int) -> Tuple[bool, np.ndarray]:
+    """Read frame number index (counting from zero) from an open capture."""
+    if not seek_frame(cap, index):
+        return False, None
+    return cap.read()
+
+
+def seek_frame(cap: cv2.VideoCapture, index: int) -> bool:
+    """Move an open capture so the next frame read is number index.
+    Seeks straight to the frame when the backend supports it, otherwise
+    grabs the frames in between, which skips converting them. Some
+    backends land on a keyframe past index, then it starts again from
+    the first frame. Returns False if the frame can't be reached.
+    """
+    if cap.set(cv2.CAP_PROP_POS_FRAMES, index):
+        if int(cap.get(cv2.CAP_PROP_POS_FRAMES)) == index:
+            return True
+
+    # seeking failed, so step forward from wherever the capture is, or
+    # from the start if it went past the frame
+    pos = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
+    if pos > index:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        pos = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
+        if pos > index:
+            return False
+    for _ in range(index - pos):
+        if not cap.grab():
+            return False
+    return True
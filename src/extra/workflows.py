@@ -14,9 +14,13 @@ def workflow1(
     filename: str = ENV.SLICED_FILENAME,
     xlsxname: str = ENV.RESULTS_DATA,
     cropped_vid: str = ENV.CROPPED_FILENAME,
+    jobs: int = 1,
+    save_video: bool = True,
+    cache_sliced: bool = True,
+    results_format: str = ENV.RESULTS_FORMAT,
 ):
     """Workflow for running on single video in a folder, and outputting the
-    results as an xlsx file to get brightness.
+    results as an xlsx (or results_format) file to get brightness.
     """
 
     vids = get_video(inlet)
@@ -31,10 +35,13 @@ def workflow1(
             basis_image=basis_image,
             dims=dims,
             filename=f"{prefix}_{filename}",
+            jobs=jobs,
+            cache_sliced=cache_sliced,
         )
-        path = rsp.run(f"{prefix}_{cropped_vid}")
+        path = rsp.run(f"{prefix}_{cropped_vid}" if save_video else None)
 
         HistogramPipeline(
             path,
             xlsxname=f"{prefix}_{xlsxname}",
+            results_format=results_format,
         )
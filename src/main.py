@@ -7,6 +7,8 @@ Created on Tue Dec  7 18:42:09 2021
 """
 import click
 
+from src.config import ENV
+from src.core.results_io import FORMATS
 from src.extra.workflows import workflow1
 from src.run.pipeline import pipeline
 
@@ -32,8 +34,44 @@ FN_MAP = {
             default for default (analyze concentration and washing), 
             workflow1 for running brightness on whole video and outputting xlsx""",
 )
-def main(inlet, type):
-    FN_MAP.get(type, pipeline)(inlet)
+@click.option(
+    "-j",
+    "--jobs",
+    "jobs",
+    default=1,
+    type=int,
+    prompt=False,
+    help="Number of processes to slice each video with",
+)
+@click.option(
+    "--video/--novideo",
+    "save_video",
+    default=True,
+    help="Save the cropped result video, or only the sliced brightness",
+)
+@click.option(
+    "--cache/--nocache",
+    "cache_sliced",
+    default=True,
+    help="Reuse sliced data from an earlier run of the same videos",
+)
+@click.option(
+    "-f",
+    "--format",
+    "results_format",
+    default=ENV.RESULTS_FORMAT,
+    type=click.Choice(list(FORMATS), case_sensitive=False),
+    prompt=False,
+    help="Format to save results data in, xlsx can be made later with src.export",
+)
+def main(inlet, type, jobs, save_video, cache_sliced, results_format):
+    FN_MAP.get(type, pipeline)(
+        inlet,
+        jobs=jobs,
+        save_video=save_video,
+        cache_sliced=cache_sliced,
+        results_format=results_format,
+    )
 
 
 if __name__ == "__main__":
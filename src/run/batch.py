@@ -0,0 +1,115 @@
+import os
+import sys
+import time
+import traceback
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import List
+
+import pandas as pd
+from src.extra.workflows import workflow1
+from src.run.pipeline import pipeline
+from src.run.utils import count_vid_files
+
+FN_MAP = {
+    "default": pipeline,
+    "workflow1": workflow1,
+}
+
+
+def run_batch(
+    inlets: List[str],
+    type: str = "default",
+    workers: int = 1,
+    summary: str = "batch_summary.csv",
+    **kwargs,
+) -> pd.DataFrame:
+    """Run the pipeline (or workflow) on many inlet folders using a pool
+    of worker processes (or in this process if workers is 1). A failure
+    in one folder is recorded and does not stop the others, even if it
+    kills its worker process. A table of status and wall time for each
+    folder is written to summary, and returned.
+    """
+    results = {}
+    try:
+        if workers > 1:
+            _run_pool(inlets, type, kwargs, workers, results)
+        else:
+            for inlet in inlets:
+                results[inlet] = _run_folder(inlet, type, kwargs)
+    finally:
+        # written even if the batch is interrupted, with the folders done
+        df = pd.DataFrame(
+            [results[i] for i in inlets if i in results],
+            columns=["inlet", "status", "seconds", "error"],
+        )
+        if summary is not None:
+            df.to_csv(summary, index=False)
+    return df
+
+
+def find_inlets(parent: str) -> List[str]:
+    """All folders directly inside parent that contain videos"""
+    folders = [
+        f"{parent}{os.sep}{f}"
+        for f in sorted(os.listdir(parent))
+        if os.path.isdir(f"{parent}{os.sep}{f}")
+    ]
+    return [f for f in folders if count_vid_files(f) > 0]
+
+
+def _run_pool(inlets: List[str], type: str, kwargs: dict, workers: int, results: dict):
+    """Run folders in a pool, no more at once than there are workers. If
+    a worker dies (killed for memory, a crash in OpenCV...) the pool is
+    broken and every folder running in it fails, so each of those is run
+    again by itself to find which one it was, and a new pool is started
+    for the rest.
+    """
+    todo = deque(inlets)
+    while todo:
+        broken = []
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            running = {}
+            while todo or running:
+                while todo and len(running) < workers and not broken:
+                    inlet = todo.popleft()
+                    running[pool.submit(_run_folder, inlet, type, kwargs)] = inlet
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    inlet = running.pop(future)
+                    try:
+                        results[inlet] = future.result()
+                    except BrokenProcessPool:
+                        broken.append(inlet)
+
+        for inlet in broken:
+            results[inlet] = _run_alone(inlet, type, kwargs)
+
+
+def _run_alone(inlet: str, type: str, kwargs: dict) -> tuple:
+    """Run one folder in its own worker process"""
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        try:
+            return pool.submit(_run_folder, inlet, type, kwargs).result()
+        except BrokenProcessPool:
+            error = "BrokenProcessPool: the worker process died"
+            print(f"Worker running {inlet} died", file=sys.stderr)
+            return inlet, "failed", time.perf_counter() - start, error
+
+
+def _run_folder(inlet: str, type: str, kwargs: dict) -> tuple:
+    """Run one folder, catching any exception so that
+    it is reported rather than ending the batch.
+    """
+    start = time.perf_counter()
+    try:
+        FN_MAP.get(type, pipeline)(inlet, **kwargs)
+        status, error = "ok", ""
+    except Exception as e:
+        status, error = "failed", f"{e.__class__.__name__}: {e}"
+        traceback.print_exc()
+    return inlet, status, time.perf_counter() - start, error
@@ -1,8 +1,9 @@
 from src.config import ENV
 from src.core.histogram_pipeline import HistogramPipeline
 from src.core.resonator_pipeline import ResonatorPipeline
+from src.extra.queues import BackgroundWorker
 from src.run.process import process_config
-from src.run.splitting import total_video_splitter
+from src.run.splitting import total_sliced_splitter, total_video_splitter
 from src.run.utils import check_results_folder, get_background
 
 
@@ -12,10 +13,17 @@ def pipeline(
     dims: dict = {"X": int(ENV.X), "Y": int(ENV.Y), "W": int(ENV.W), "H": int(ENV.H)},
     plot_name: str = ENV.HIST_PLOT,
     filename: str = ENV.SLICED_FILENAME,
+    jobs: int = 1,
+    save_video: bool = True,
+    cache_sliced: bool = True,
+    results_format: str = ENV.RESULTS_FORMAT,
+    background_plots: bool = True,
 ):
     """Run the main pipeline for image processing, including video splitting,
     and actual video pipeline, which includes extracting brightness data from the
-    video and plotting data alongside cell counts
+    video and plotting data alongside cell counts. Plots are rendered in a
+    background thread while the next video is processed, unless
+    background_plots is False, and are all saved before this returns.
     """
 
     # process config, aka get data dictionary with video and cell counts
@@ -26,30 +34,41 @@ def pipeline(
 
     # iterate over each item in data items and run pipeline
     # is sorted so that concentration will always come first
-    for data_type in sorted(data_items):
-
-        # for total video, need to first split
-        # videos, then run each individually
-        if data_type == "total":
-            total_video_pipeline(
-                data_items,
-                basis_image,
-                dims,
-                plot_name,
-                filename,
-                wash_start=wash_start,
-            )
-        else:
-            # standard pipeline to run
-            _run_pipeline(
-                data_items[data_type],
-                data_type,
-                basis_image,
-                dims,
-                plot_name,
-                filename,
-                wash_start=wash_start,
-            )
+    with BackgroundWorker(background_plots) as plotter:
+        for data_type in sorted(data_items):
+
+            # for total video, need to first split
+            # videos, then run each individually
+            if data_type == "total":
+                total_video_pipeline(
+                    data_items,
+                    basis_image,
+                    dims,
+                    plot_name,
+                    filename,
+                    wash_start=wash_start,
+                    jobs=jobs,
+                    save_video=save_video,
+                    cache_sliced=cache_sliced,
+                    results_format=results_format,
+                    plotter=plotter,
+                )
+            else:
+                # standard pipeline to run
+                _run_pipeline(
+                    data_items[data_type],
+                    data_type,
+                    basis_image,
+                    dims,
+                    plot_name,
+                    filename,
+                    wash_start=wash_start,
+                    jobs=jobs,
+                    save_video=save_video,
+                    cache_sliced=cache_sliced,
+                    results_format=results_format,
+                    plotter=plotter,
+                )
 
 
 def total_video_pipeline(
@@ -59,30 +78,45 @@ def total_video_pipeline(
     plot_name: str = ENV.HIST_PLOT,
     filename: str = ENV.SLICED_FILENAME,
     wash_start: float = 0.0,
+    jobs: int = 1,
+    save_video: bool = True,
+    cache_sliced: bool = True,
+    results_format: str = ENV.RESULTS_FORMAT,
+    plotter: BackgroundWorker = None,
 ):
     """In the case that a video of the total workflow is provided, then
     the data needs to be separated into concentration and washing so
-    that it is processed in the same manner as individual videos.
+    that it is processed in the same manner as individual videos. The
+    total video is only decoded once, and the sliced data is split into
+    concentration and washing using the times in the reference data.
     """
 
-    # split video into parts and save
-    targets = total_video_splitter(data_dict["total"])
+    # slice the whole video in one pass
+    path, fps = _run_resonator(
+        data_dict["total"]["video"],
+        "total",
+        basis_image,
+        dims,
+        filename,
+        jobs=jobs,
+        save_video=save_video,
+        cache_sliced=cache_sliced,
+    )
 
-    # create dictionaries in form of concentration/washing
-    # then run regular pipeline
-    for title in ("concentration", "washing"):
-        _data_dict_tmp = {}
-        _data_dict_tmp["video"] = targets[title]
-        _data_dict_tmp["data"] = data_dict["total"]["data"]
+    # split sliced data into parts and save
+    targets = total_sliced_splitter(data_dict["total"], path, filename)
 
-        _run_pipeline(
-            _data_dict_tmp,
+    # then run regular histogram pipeline on each part
+    for title in ("concentration", "washing"):
+        _run_histogram(
+            targets[title],
+            data_dict["total"]["data"],
             title,
-            basis_image,
-            dims,
+            fps,
             plot_name,
-            filename,
             wash_start=wash_start,
+            results_format=results_format,
+            plotter=plotter,
         )
 
 
@@ -96,35 +130,105 @@ def _run_pipeline(
     xlsxname: str = ENV.RESULTS_DATA,
     cropped_vid: str = ENV.CROPPED_FILENAME,
     wash_start: float = 0.0,
+    jobs: int = 1,
+    save_video: bool = True,
+    cache_sliced: bool = True,
+    results_format: str = ENV.RESULTS_FORMAT,
+    plotter: BackgroundWorker = None,
 ):
     """The main video processing pipeline for all types. Runs
-    resonator pipeline, which produces csv results, then gets
-    background and produces histogram/csv results.
+    resonator pipeline, which produces sliced results, then gets
+    background and produces histogram/xlsx results. The cropped
+    video is only written if save_video is True.
     """
 
-    # Run video processing, produce csv results
-    rsp = ResonatorPipeline(
+    # Run video processing, produce sliced results
+    path, fps = _run_resonator(
         data_dict["video"],
+        data_type,
+        basis_image,
+        dims,
+        filename,
+        cropped_vid,
+        jobs=jobs,
+        save_video=save_video,
+        cache_sliced=cache_sliced,
+    )
+
+    _run_histogram(
+        path,
+        data_dict["data"],
+        data_type,
+        fps,
+        plot_name,
+        xlsxname,
+        wash_start=wash_start,
+        results_format=results_format,
+        plotter=plotter,
+    )
+
+
+def _run_resonator(
+    video: str,
+    data_type: str,
+    basis_image: str = ENV.BASIS_IMAGE,
+    dims: dict = {"X": int(ENV.X), "Y": int(ENV.Y), "W": int(ENV.W), "H": int(ENV.H)},
+    filename: str = ENV.SLICED_FILENAME,
+    cropped_vid: str = ENV.CROPPED_FILENAME,
+    jobs: int = 1,
+    save_video: bool = True,
+    cache_sliced: bool = True,
+):
+    """Run resonator pipeline on video, returning the path
+    to the sliced data and the fps of the video.
+    """
+    rsp = ResonatorPipeline(
+        video,
         basis_image=basis_image,
         dims=dims,
         filename=f"{data_type}_{filename}",
+        jobs=jobs,
+        cache_sliced=cache_sliced,
     )
-    path = rsp.run(f"{data_type}_{cropped_vid}")
+    path = rsp.run(f"{data_type}_{cropped_vid}" if save_video else None)
+    return path, rsp.fps
+
+
+def _run_histogram(
+    path: str,
+    data: dict,
+    data_type: str,
+    fps: float,
+    plot_name: str = ENV.HIST_PLOT,
+    xlsxname: str = ENV.RESULTS_DATA,
+    wash_start: float = 0.0,
+    results_format: str = ENV.RESULTS_FORMAT,
+    plotter: BackgroundWorker = None,
+):
+    """Subtract background from sliced data, then plot histogram and
+    save results. The plot is handed to plotter to render in the
+    background if given, otherwise it is rendered here.
+    """
 
-    # Get background intensity from csv file
+    # Get background intensity from sliced data
     _background = get_background(path)
 
     # Plot histogram + save xlsx results
     htp = HistogramPipeline(
         path,
-        data_dict["data"][data_type],
+        data[data_type],
         xlsxname=f"{data_type}_{xlsxname}",
-        s_per_frame=1 / rsp.fps,
+        s_per_frame=1 / fps,
         vid_start=wash_start if data_type == "washing" else 0.0,
         background=_background,
+        results_format=results_format,
     )
-    htp.plot(
+    if plotter is None:
+        plotter = BackgroundWorker(background=False)
+    plotter.submit(
+        htp.plot,
         title=f"Histogram for {data_type.capitalize()}",
         save=True,
         filename=f"{data_type}_{plot_name}",
+        headless=True,
     )
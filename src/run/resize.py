@@ -7,6 +7,10 @@ import moviepy.editor as mp
 def get_downscaled_video(
     video_path: str, downsize: bool, height: int = 360, width: int = None
 ):
+    """Re-encode the video at a smaller size, to _small.mp4 next to the
+    original, and return its path. Only used with DOWNSIZE_MODE = file,
+    otherwise ResonatorPipeline shrinks the ROI as frames are decoded.
+    """
     if not downsize:
         return video_path
     # Note that I would use ffmpeg, however users of this script
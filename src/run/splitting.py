@@ -4,15 +4,77 @@ from typing import Tuple
 from cv2 import watershed
 from moviepy.editor import VideoFileClip
 from moviepy.video.io.ffmpeg_tools import ffmpeg_extract_subclip
+from src.core.sliced_io import (
+    compute_background,
+    load_meta,
+    load_sliced,
+    save_sliced,
+)
 from src.extra.tools import check_dir_make
 
 
 def total_video_splitter(data_dict: dict) -> dict:
-    """High-level function for splitting total video"""
+    """High-level function for splitting total video into two new videos.
+    The pipeline now slices the total video once and splits the sliced
+    data with total_sliced_splitter instead.
+    """
     target_dat = _split_data(data_dict)
     return {dat[0]: _split_video(data_dict["video"], dat) for dat in target_dat}
 
 
+def total_sliced_splitter(data_dict: dict, path_sliced: str, filename: str) -> dict:
+    """Split the sliced data from a total video into concentration and
+    washing, using the end of concentration and start of washing in the
+    reference data. Each part is saved beside the total data as
+    {title}_{filename}, and the paths are returned by title.
+    """
+    ref_dict = _ref_dict(data_dict)
+    end_conc = _get_time(
+        ref_dict,
+        "End of concentration",
+        "Failed to split total video, there is no concentration end in the xlsx. Add to cell N6",
+    )
+    start_wash = _get_time(
+        ref_dict,
+        "Start of washing",
+        "Failed to split total video, there is no washing start in the xlsx. Add to cell N7",
+    )
+
+    sliced, meta = load_sliced(path_sliced), load_meta(path_sliced)
+
+    # each row is the average of slice_freq frames
+    rows_per_s = meta["fps"] / meta["slice_freq"]
+    rows = {
+        "concentration": (0, round(end_conc * rows_per_s)),
+        "washing": (round(start_wash * rows_per_s), len(sliced)),
+    }
+
+    folder = os.path.dirname(path_sliced)
+    return {
+        title: _save_part(
+            sliced[start:stop],
+            meta,
+            start / rows_per_s,
+            f"{folder}{os.sep}{title}_{filename}",
+        )
+        for title, (start, stop) in rows.items()
+    }
+
+
+def _save_part(sliced, meta: dict, start_time: float, path: str) -> str:
+    """Save part of the sliced data, with its own start time
+    and background in the metadata.
+    """
+    _meta = dict(meta, start_time=start_time)
+    background = dict(meta.get("background", {}))
+    if background and len(sliced):
+        background["value"] = compute_background(
+            sliced, background["nframes"], background["window"]
+        )
+        _meta["background"] = background
+    return save_sliced(path, sliced, _meta)
+
+
 def _split_data(data_dict: dict) -> tuple:
     """HistogramPipeline is only set up to do a single phase - be that
     concentration or washing. In order to run a "total video" need to
@@ -22,8 +84,7 @@ def _split_data(data_dict: dict) -> tuple:
 
     # make dictionary out of dataframe ref_data which
     # includes important info about start & stop of vid
-    ref_dat = data_dict["data"]["reference"]["data"]
-    ref_dict = dict(zip(ref_dat["index"], ref_dat.value))
+    ref_dict = _ref_dict(data_dict)
 
     # Access important info for splitting
     _conc_tuple, _wash_tuple = _get_tuples(ref_dict, data_dict)
@@ -34,6 +95,21 @@ def _split_data(data_dict: dict) -> tuple:
     )
 
 
+def _ref_dict(data_dict: dict) -> dict:
+    ref_dat = data_dict["data"]["reference"]["data"]
+    return dict(zip(ref_dat["index"], ref_dat.value))
+
+
+def _get_time(ref_dict: dict, name: str, message: str) -> float:
+    """Get time in seconds from reference data, throw exception
+    with message if it is not present.
+    """
+    try:
+        return float(ref_dict[name])
+    except:
+        raise Exception(message)
+
+
 def _get_tuples(ref_dict: dict, data_dict: dict) -> Tuple[tuple, tuple]:
     """Try to access important values for video splitting. Throw exception if
     these values are not present.
@@ -1,7 +1,7 @@
 import os
 
-import numpy as np
 from src.config import ENV
+from src.core.sliced_io import compute_background, load_meta, load_sliced
 
 
 def get_background(
@@ -10,20 +10,25 @@ def get_background(
     window: tuple = (int(ENV.WIN_TOP), int(ENV.WIN_BOTTOM)),
 ) -> float:
     """Get the average background intensity from the concentration
-    sliced csv and return so it may be subtracted.
+    sliced data and return so it may be subtracted. Uses the background
+    saved in the metadata when it was computed with the same settings.
     """
-    try:
-        _fname = fname.replace("washing", "concentration")
-        sliced = np.loadtxt(_fname, delimiter=",")
-    except:
+    _fname = fname.replace("washing", "concentration")
+    if not os.path.exists(_fname):
         print(
             "There is no concentration data, attemping to load washing data. Background subtraction with washing data is not advised."
         )
-        _fname = fname.replace("concentration", "washing")
-        sliced = np.loadtxt(fname, delimiter=",")
+        _fname = fname
 
-    means = sliced[:, window[0] : window[1]].mean(axis=1)
-    return np.mean(means[:nframes_back])
+    background = load_meta(_fname).get("background", {})
+    if (
+        background.get("value") is not None
+        and background.get("nframes") == nframes_back
+        and tuple(background.get("window", ())) == tuple(window)
+    ):
+        return background["value"]
+
+    return compute_background(load_sliced(_fname), nframes_back, window)
 
 
 def check_results_folder(inlet: str):
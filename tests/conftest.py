@@ -2,6 +2,8 @@ import json
 import os
 import shutil
 
+import cv2
+import numpy as np
 import pandas as pd
 import pytest
 from src.config import ENV
@@ -40,5 +42,31 @@ def cleaning():
     return _cleaning
 
 
+@pytest.fixture(scope="module")
+def synthetic_video(tmp_path_factory):
+    """Write a short video made from the test basis image, with the
+    brightness of the top left corner changing over time, so that
+    registration finds (close to) the identity homography.
+    """
+
+    def _synthetic_video(n_frames=140, fps=30, name="synthetic_vid.mp4"):
+        folder = tmp_path_factory.mktemp("synthetic")
+        basis = cv2.imread(f"tests{os.sep}data{os.sep}test_basis.jpg")
+        height, width = basis.shape[:2]
+
+        path = f"{folder}{os.sep}{name}"
+        out = cv2.VideoWriter(
+            path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height)
+        )
+        for i in range(n_frames):
+            frame = basis.copy()
+            frame[:60, :80, :] = np.uint8(40 + (i * 3) % 200)
+            out.write(frame)
+        out.release()
+        return path
+
+    return _synthetic_video
+
+
 def _get_files_made():
     return ("results", "split_vids")
@@ -0,0 +1,45 @@
+import multiprocessing as mp
+import os
+
+import pytest
+from src.run import batch
+from src.run.batch import run_batch
+
+
+def _fake_pipeline(inlet, **kwargs):
+    if "bad" in inlet:
+        raise ValueError("bad xlsx")
+
+
+def test_run_batch_isolates_failures(tmp_path, monkeypatch):
+    monkeypatch.setitem(batch.FN_MAP, "default", _fake_pipeline)
+    summary = f"{tmp_path}{os.sep}summary.csv"
+
+    # a single worker runs in this process, so the fake pipeline is used
+    df = run_batch(["good_1", "bad_1", "good_2"], workers=1, summary=summary)
+
+    assert list(df.inlet) == ["good_1", "bad_1", "good_2"]
+    assert list(df.status) == ["ok", "failed", "ok"]
+    assert "ValueError: bad xlsx" in df.error[1]
+    assert os.path.exists(summary)
+
+
+def _crashing_pipeline(inlet, **kwargs):
+    if "crash" in inlet:
+        os._exit(1)
+
+
+@pytest.mark.skipif(
+    mp.get_start_method() != "fork", reason="workers must inherit the fake pipeline"
+)
+def test_run_batch_survives_dead_worker(tmp_path, monkeypatch):
+    monkeypatch.setitem(batch.FN_MAP, "default", _crashing_pipeline)
+    summary = f"{tmp_path}{os.sep}summary.csv"
+
+    inlets = ["good_1", "crash_1", "good_2", "good_3", "good_4"]
+    df = run_batch(inlets, workers=2, summary=summary)
+
+    assert list(df.inlet) == inlets
+    assert list(df.status) == ["ok", "failed", "ok", "ok", "ok"]
+    assert "BrokenProcessPool" in df.error[1]
+    assert os.path.exists(summary)
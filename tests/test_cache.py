@@ -0,0 +1,31 @@
+import os
+import time
+
+from src.extra.cache import DiskCache
+
+
+def test_disk_cache_lru(tmp_path):
+    cache = DiskCache(str(tmp_path), max_entries=2)
+    cache.put_json("a", {"v": 1})
+    time.sleep(0.01)
+    cache.put_json("b", {"v": 2})
+    time.sleep(0.01)
+
+    # reading a marks it as recently used, so b is evicted by c
+    assert cache.get_json("a") == {"v": 1}
+    time.sleep(0.01)
+    cache.put_json("c", {"v": 3})
+
+    assert cache.get_json("b") is None
+    assert sorted(os.listdir(tmp_path)) == ["a", "c"]
+
+
+def test_disk_cache_max_bytes(tmp_path):
+    src = tmp_path / "src.bin"
+    src.write_bytes(b"0" * 100)
+    cache = DiskCache(str(tmp_path / "cache"), max_bytes=250)
+    for key in ("a", "b", "c"):
+        cache.put(key, {"data.bin": str(src)})
+        time.sleep(0.01)
+    assert cache.get("a") is None
+    assert os.path.exists(f"{cache.get('c')}{os.sep}data.bin")
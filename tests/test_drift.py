@@ -0,0 +1,60 @@
+import os
+import time
+
+import cv2
+import numpy as np
+from src.api.drift import DriftTracker, warp_roi
+
+
+def _shifted(image, dx, dy):
+    M = np.float32([[1, 0, dx], [0, 1, dy]])
+    return cv2.warpAffine(image, M, image.shape[1::-1], borderMode=cv2.BORDER_REFLECT)
+
+
+def _wait_idle(drift, processed, timeout=10):
+    """Wait until the registration thread has handled processed frames,
+    so that the next frame isn't dropped for arriving while it is busy.
+    """
+    end = time.monotonic() + timeout
+    while drift.stats()["processed"] < processed:
+        assert time.monotonic() < end, "registration didn't finish"
+        time.sleep(0.01)
+
+
+def test_warp_roi_translation():
+    M = np.float64([[1, 0, 12], [0, 1, -7], [0, 0, 1]])
+    assert warp_roi(M, (100, 50, 200, 80)) == (112, 43, 200, 80)
+
+
+def test_drift_moves_roi():
+    basis = cv2.imread(f"tests{os.sep}data{os.sep}test_basis.jpg")
+    config = {"X": 200, "Y": 100, "W": 150, "H": 80}
+    drift = DriftTracker(every_s=1, threshold=3)
+
+    assert drift.put(basis, config, now=0)
+    _wait_idle(drift, 1)
+    assert not drift.put(basis, config, now=500)  # too soon
+    assert drift.put(_shifted(basis, 15, -10), config, now=1000)
+    drift.close()
+
+    assert drift.apply(config)
+    assert abs(config["X"] - 215) <= 1 and abs(config["Y"] - 90) <= 1
+    assert abs(config["W"] - 150) <= 1 and abs(config["H"] - 80) <= 1
+    assert drift.stats()["corrections"] == 1
+    assert not drift.apply(config)
+
+
+def test_drift_ignores_small_shift():
+    basis = cv2.imread(f"tests{os.sep}data{os.sep}test_basis.jpg")
+    config = {"X": 200, "Y": 100, "W": 150, "H": 80}
+    drift = DriftTracker(every_s=1, threshold=5)
+    assert drift.put(basis, config, now=0)
+    _wait_idle(drift, 1)
+    assert drift.put(_shifted(basis, 2, 1), config, now=1000)
+    drift.close()
+
+    assert drift.stats()["processed"] == 2
+    assert drift.stats()["failed"] == 0
+
+    assert not drift.apply(config)
+    assert (config["X"], config["Y"]) == (200, 100)
@@ -0,0 +1,69 @@
+import os
+
+import numpy as np
+import pandas as pd
+from src.core.histogram_pipeline import HistogramPipeline
+from src.core.histogram_sweep import HistogramSweep
+from src.core.sliced_io import save_sliced
+
+
+def _data(tmp_path):
+    rng = np.random.default_rng(0)
+    sliced = rng.uniform(0, 255, (400, 40))
+    path = save_sliced(f"{tmp_path}{os.sep}sliced.npy", sliced)
+    t = np.linspace(100, 900, 30)
+    cells = pd.DataFrame({"time": t, "count": rng.uniform(0, 1, 30)})
+    return path, {"cells": cells, "sensor": pd.DataFrame(np.full((1, 2), np.nan))}
+
+
+def test_sweep_matches_histogram_pipeline(tmp_path):
+    path, data = _data(tmp_path)
+    windows, stds, tcs = [(0, 25), (5, 40)], [3, 10], [0.0, 50.0]
+    coeffs = [(1.0, 0.0), (-0.2, 3.0)]
+
+    sweep = HistogramSweep(path, data, s_per_frame=0.5, background=2.0)
+    curves = sweep.curves(windows, stds, tcs, coeffs)
+    assert len(curves) == 2
+    time, brightness = curves[1]
+    assert brightness.shape == (2, 2, 2, len(time))
+
+    for i, window in enumerate(windows):
+        for j, std in enumerate(stds):
+            for k, coeff in enumerate(coeffs):
+                hist = HistogramPipeline(
+                    path,
+                    {key: df.copy() for key, df in data.items()},
+                    out_folder=str(tmp_path),
+                    window=window,
+                    t_correct=50.0,
+                    xlsxname=None,
+                    s_per_frame=0.5,
+                    gauss_std=std,
+                    background=2.0,
+                    coeffs=coeff,
+                )
+                np.testing.assert_allclose(time, hist.brightness[:, 0])
+                np.testing.assert_allclose(brightness[k, j, i], hist.brightness[:, 1])
+
+
+def test_sweep_fit_metrics(tmp_path):
+    path, data = _data(tmp_path)
+    sweep = HistogramSweep(path, data, s_per_frame=0.5)
+    df = sweep.run([(0, 25), (5, 40)], [0, 10, 20], [0.0, 50.0], [(1.0, 0.0)])
+
+    assert len(df) == 12
+    assert {"cells_rmse", "cells_r"} <= set(df.columns)
+    assert "sensor_rmse" not in df.columns
+    assert np.all(np.isfinite(df.cells_rmse))
+
+    # metrics agree with comparing one curve by hand
+    row = df.iloc[-1]
+    [(time, brightness)] = sweep.curves(
+        [row.window], [row.gauss_std], [row.t_correct], [(1.0, 0.0)]
+    )
+    cells = data["cells"].values
+    inside = (cells[:, 0] / 60 >= time[0]) & (cells[:, 0] / 60 <= time[-1])
+    pred = np.interp(cells[inside, 0] / 60, time, brightness[0, 0, 0])
+    assert np.isclose(row.cells_rmse, np.sqrt(np.mean((pred - cells[inside, 1]) ** 2)))
+    assert np.isclose(row.cells_r, np.corrcoef(pred, cells[inside, 1])[0, 1])
+    assert not os.path.exists(f"{tmp_path}{os.sep}results")
@@ -1,8 +1,15 @@
 import os
 import shutil
 
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import pytest
+import scipy.ndimage
 from src.config import ENV
-from src.core.histogram_pipeline import HistogramPipeline
+from src.core.histogram_pipeline import HistogramPipeline, minmax_decimate
+from src.core.sliced_io import save_sliced
+from src.extra.queues import BackgroundWorker
 
 
 def test_histogram_pipeline(load_result_data):
@@ -19,3 +26,54 @@ def test_histogram_pipeline(load_result_data):
     )
 
     shutil.rmtree(f"tests{os.sep}data{os.sep}sample_output{os.sep}results")
+
+
+def test_minmax_decimate():
+    rng = np.random.default_rng(0)
+    x = np.linspace(0, 100, 50_000)
+    y = scipy.ndimage.gaussian_filter1d(rng.normal(size=50_000), 20)
+    dx, dy = minmax_decimate(x, y, 1000)
+
+    assert len(dy) <= 2002 and dx[0] == x[0] and dx[-1] == x[-1]
+    assert np.all(np.diff(dx) > 0)
+    assert dy.min() == y.min() and dy.max() == y.max()
+    # short series are left alone
+    assert len(minmax_decimate(x[:100], y[:100], 1000)[1]) == 100
+
+
+def test_headless_plot(tmp_path):
+    rng = np.random.default_rng(0)
+    sliced = rng.uniform(0, 255, (20_000, 30))
+    path = save_sliced(f"{tmp_path}{os.sep}sliced.npy", sliced)
+    data = {"cells": np.full((1, 2), np.nan), "sensor": np.full((1, 2), np.nan)}
+    data = {key: pd.DataFrame(value) for key, value in data.items()}
+    htp = HistogramPipeline(path, data, out_folder=str(tmp_path), xlsxname=None)
+
+    # decimated plot looks the same as plotting every point
+    images = []
+    for decimate in (False, True):
+        fig = htp.plot("title", headless=True, decimate=decimate)
+        fig.canvas.draw()
+        images.append(np.asarray(fig.canvas.buffer_rgba(), dtype=float))
+    assert np.mean(np.abs(images[0] - images[1])) < 0.5
+
+    # saving in the background doesn't leave figures open in pyplot
+    figures = plt.get_fignums()
+    with BackgroundWorker() as plotter:
+        plotter.submit(htp.plot, "title", save=True, filename="plot.png", headless=True)
+    assert os.path.exists(f"{tmp_path}{os.sep}plot.png")
+    assert plt.get_fignums() == figures
+
+    # by default the figure is made with pyplot, so plt.show() shows it
+    fig = htp.plot("title")
+    assert fig.number in plt.get_fignums()
+    plt.close(fig)
+
+
+def test_background_worker_raises():
+    def fail():
+        raise ValueError("failed plot")
+
+    with pytest.raises(ValueError):
+        with BackgroundWorker() as plotter:
+            plotter.submit(fail)
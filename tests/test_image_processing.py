@@ -1,7 +1,25 @@
 import os
+import threading
 
+import cv2
+import numpy as np
+import pytest
 from src.config import ENV
-from src.core.resonator_pipeline import ResonatorPipeline
+from src.core.resonator_pipeline import (
+    GroupedAverage,
+    ResonatorPipeline,
+    SliceReducer,
+    _clip_roi,
+    _grouped_avg,
+    _slice_chunk,
+    frame_to_slice,
+    frames_to_slices,
+)
+from src.core.sliced_io import load_meta, load_sliced
+from src.extra.queues import TimedQueue
+from src.extra.tools import read_frame
+
+_VideoCapture = cv2.VideoCapture
 
 FOLDER = f"tests{os.sep}data{os.sep}test_folder_2files"
 VID_PATH = f"{FOLDER}{os.sep}vid_Washing.mp4"
@@ -16,3 +34,362 @@ def test_resonator_pipeline(cleaning):
     )
     rep.run()
     cleaning(FOLDER)
+
+
+def test_decode_thread_matches_serial(synthetic_video):
+    vid = synthetic_video()
+    dims = {"X": 5, "Y": 5, "W": 50, "H": 40}
+    rep = ResonatorPipeline(
+        vid,
+        dims=dims,
+        basis_image="tests/data/test_basis.jpg",
+        queue_size=2,
+        cache_dir=None,
+    )
+    path = rep.run()
+
+    # read video serially with the coordinates found by registration
+    cap = cv2.VideoCapture(vid)
+    slices = []
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        crop = frame[rep.Y : rep.Y + rep.H, rep.X : rep.X + rep.W, :]
+        slices.append(frame_to_slice(crop))
+    cap.release()
+
+    expected = _grouped_avg(np.stack(slices, axis=0))
+    np.testing.assert_allclose(load_sliced(path), expected)
+    assert load_meta(path)["slice_freq"] == rep.slice_freq
+    assert set(rep.queue_stats) == {
+        "decode_blocked",
+        "reduce_blocked",
+        "encode_blocked",
+    }
+
+
+def test_decoded_crops_dont_hold_frames(synthetic_video):
+    vid = synthetic_video(n_frames=10, name="decode_vid.mp4")
+    rep = ResonatorPipeline(
+        vid,
+        dims={"X": 5, "Y": 5, "W": 50, "H": 40},
+        basis_image="tests/data/test_basis.jpg",
+        queue_size=16,
+        cache_dir=None,
+    )
+    frames = TimedQueue(maxsize=16)
+    cap = cv2.VideoCapture(vid)
+    rep._decode_frames(cap, frames)
+    cap.release()
+
+    crops = [frames.get() for _ in range(10)]
+    assert frames.get() is None
+    assert all(c.base is None and c.shape == (40, 50, 3) for c in crops)
+
+
+def test_decoder_stops_when_slicing_fails(synthetic_video, monkeypatch):
+    vid = synthetic_video(name="fail_vid.mp4")
+    rep = ResonatorPipeline(
+        vid,
+        dims={"X": 5, "Y": 5, "W": 50, "H": 40},
+        basis_image="tests/data/test_basis.jpg",
+        queue_size=1,
+        cache_dir=None,
+    )
+
+    def _fail(self, frame):
+        raise ValueError("slicing failed")
+
+    monkeypatch.setattr(SliceReducer, "add", _fail)
+    with pytest.raises(ValueError, match="slicing failed"):
+        rep.run(None)
+
+    # the decoder isn't left waiting on the full queue, holding the video
+    assert rep._cap is None
+    assert not any(t.name == "FrameDecoder" for t in threading.enumerate())
+
+
+def test_parallel_matches_serial(synthetic_video):
+    vid = synthetic_video()
+    dims = {"X": 5, "Y": 5, "W": 50, "H": 40}
+    serial = ResonatorPipeline(
+        vid,
+        dims=dims,
+        basis_image="tests/data/test_basis.jpg",
+        filename="serial.csv",
+        cache_dir=None,
+    ).run()
+    parallel = ResonatorPipeline(
+        vid,
+        dims=dims,
+        basis_image="tests/data/test_basis.jpg",
+        filename="parallel.csv",
+        jobs=3,
+        cache_dir=None,
+    ).run()
+    np.testing.assert_array_equal(load_sliced(serial), load_sliced(parallel))
+
+
+def test_roi_past_frame_edge(synthetic_video):
+    # the basis is 360 px high, so the ROI runs 20 px past the bottom
+    vid = synthetic_video()
+    dims = {"X": 5, "Y": 340, "W": 50, "H": 40}
+    serial = ResonatorPipeline(
+        vid,
+        dims=dims,
+        basis_image="tests/data/test_basis.jpg",
+        filename="edge_serial.csv",
+        cache_dir=None,
+    )
+    path = serial.run()
+    assert serial.Y + serial.H <= 360
+
+    # same slices as cropping each frame with numpy, which cuts at the edge
+    cap = cv2.VideoCapture(vid)
+    slices = []
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        crop = frame[serial.Y : serial.Y + 40, serial.X : serial.X + serial.W, :]
+        slices.append(frame_to_slice(crop))
+    cap.release()
+    np.testing.assert_allclose(load_sliced(path), _grouped_avg(np.stack(slices)))
+
+    parallel = ResonatorPipeline(
+        vid,
+        dims=dims,
+        basis_image="tests/data/test_basis.jpg",
+        filename="edge_parallel.csv",
+        jobs=3,
+        cache_dir=None,
+    ).run()
+    np.testing.assert_array_equal(load_sliced(path), load_sliced(parallel))
+
+
+def test_clip_roi():
+    shape = (360, 640, 3)
+    assert _clip_roi((5, 340, 50, 40), shape) == (5, 340, 50, 20)
+    assert _clip_roi((-10, 5, 50, 40), shape) == (0, 5, 40, 40)
+    assert _clip_roi((5, 5, 50, 40), shape) == (5, 5, 50, 40)
+    assert _clip_roi((700, 5, 50, 40), shape) == (640, 5, 0, 40)
+
+
+def test_no_video_mode(synthetic_video):
+    vid = synthetic_video()
+    rep = ResonatorPipeline(
+        vid,
+        dims={"X": 5, "Y": 5, "W": 50, "H": 40},
+        basis_image="tests/data/test_basis.jpg",
+        cache_dir=None,
+    )
+    rep.run(None)
+    assert not os.path.exists(f"{rep.out_folder}{os.sep}{ENV.CROPPED_FILENAME}")
+    assert "encode_blocked" not in rep.queue_stats
+
+
+def test_grouped_average_matches_cumsum():
+    slices = np.random.default_rng(0).uniform(0, 255, (23, 7))
+    averager = GroupedAverage(7, 5)
+    rows = [averager.add(s) for s in slices]
+    rows = np.stack([r for r in rows if r is not None])
+    assert averager.finish() is None
+    np.testing.assert_allclose(rows, _grouped_avg(slices, 5))
+
+    # the 3 slices after the last full group are averaged into a last row
+    averager = GroupedAverage(7, 5, remainder="keep")
+    for s in slices:
+        averager.add(s)
+    np.testing.assert_allclose(averager.finish(), slices[-3:].mean(axis=0))
+
+
+def test_frames_to_slices_matches_frame_to_slice():
+    block = np.random.default_rng(0).integers(0, 256, (4, 13, 9, 3), dtype=np.uint8)
+    expected = np.stack([f.astype(float).mean(axis=2).mean(axis=1) for f in block])
+    np.testing.assert_allclose(frames_to_slices(block), expected)
+
+    # cropped views are not contiguous
+    crops = block[:, :, 2:7]
+    expected = np.stack([f.astype(float).mean(axis=2).mean(axis=1) for f in crops])
+    np.testing.assert_allclose(frames_to_slices(crops), expected)
+
+
+def test_slice_reducer_full_blocks():
+    # no partial block is left to slice when the frames fill whole blocks
+    reducer = SliceReducer(4, 6, slice_freq=2, batch_size=4)
+    frames = np.random.default_rng(0).integers(0, 256, (8, 4, 6, 3), dtype=np.uint8)
+    rows = [row for frame in frames for row in reducer.add(frame)]
+    rows.extend(reducer.finish())
+    np.testing.assert_allclose(
+        np.stack(rows), _grouped_avg(frames_to_slices(frames), 2), rtol=1e-12
+    )
+
+
+def test_homography_cache(synthetic_video, tmp_path, monkeypatch):
+    vid = synthetic_video()
+    kwargs = dict(
+        dims={"X": 5, "Y": 5, "W": 50, "H": 40},
+        basis_image="tests/data/test_basis.jpg",
+        cache_dir=str(tmp_path),
+    )
+    first = ResonatorPipeline(vid, **kwargs)
+    first.normalize_data()
+
+    # second registration should come from the cache, without matching
+    def _fail(*args):
+        raise AssertionError("feature matching should be skipped")
+
+    monkeypatch.setattr(ResonatorPipeline, "_get_homography", _fail)
+    second = ResonatorPipeline(vid, **kwargs)
+    second.normalize_data()
+    assert (first.X, first.Y, first.W, first.H) == (
+        second.X,
+        second.Y,
+        second.W,
+        second.H,
+    )
+    np.testing.assert_allclose(first.homography, second.homography)
+
+
+def test_read_frame_matches_serial(synthetic_video):
+    vid = synthetic_video()
+    cap = cv2.VideoCapture(vid)
+    for _ in range(58):
+        _, expected = cap.read()
+    cap.release()
+
+    cap = cv2.VideoCapture(vid)
+    success, frame = read_frame(cap, 57)
+    cap.release()
+    assert success
+    np.testing.assert_array_equal(frame, expected)
+
+
+class _OvershootingCapture:
+    """Capture that seeks to the next 'keyframe', past the one asked for"""
+
+    def __init__(self, path, overshoot=7):
+        self._cap = _VideoCapture(path)
+        self.overshoot = overshoot
+
+    def set(self, prop, value):
+        if prop == cv2.CAP_PROP_POS_FRAMES and value > 0:
+            value += self.overshoot
+        return self._cap.set(prop, value)
+
+    def __getattr__(self, name):
+        return getattr(self._cap, name)
+
+
+def test_read_frame_after_overshoot(synthetic_video):
+    vid = synthetic_video()
+    cap = cv2.VideoCapture(vid)
+    for _ in range(58):
+        _, expected = cap.read()
+    cap.release()
+
+    cap = _OvershootingCapture(vid)
+    success, frame = read_frame(cap, 57)
+    cap.release()
+    assert success
+    np.testing.assert_array_equal(frame, expected)
+
+
+def test_chunk_after_overshoot(synthetic_video, monkeypatch):
+    vid = synthetic_video()
+    args = (40, 80, (5, 5, 50, 40), None, 5, "drop", 8)
+    expected = _slice_chunk(vid, *args)
+
+    monkeypatch.setattr(cv2, "VideoCapture", _OvershootingCapture)
+    np.testing.assert_array_equal(_slice_chunk(vid, *args), expected)
+
+
+def test_downsize_roi(synthetic_video):
+    vid = synthetic_video()
+    kwargs = dict(
+        dims={"X": 5, "Y": 5, "W": 50, "H": 40},
+        basis_image="tests/data/test_basis.jpg",
+        downsize=True,
+        downsize_mode="roi",
+        downsize_height=180,
+        cache_dir=None,
+    )
+    rep = ResonatorPipeline(vid, filename="small.csv", **kwargs)
+    sliced = load_sliced(rep.run(None))
+
+    # the test video is 360 px high, so the ROI is halved
+    assert rep.size == (round(rep.W / 2), round(rep.H / 2))
+    assert sliced.shape[1] == rep.size[1]
+    assert not os.path.exists(vid.replace(".mp4", "_small.mp4"))
+
+    parallel = ResonatorPipeline(vid, filename="small_par.csv", jobs=2, **kwargs)
+    np.testing.assert_array_equal(load_sliced(parallel.run(None)), sliced)
+
+
+def test_resume_from_checkpoint(synthetic_video, tmp_path, monkeypatch):
+    vid = synthetic_video(n_frames=143)
+    kwargs = dict(
+        dims={"X": 5, "Y": 5, "W": 50, "H": 40},
+        basis_image="tests/data/test_basis.jpg",
+        cache_dir=str(tmp_path),
+        checkpoint_every=4,
+        batch_size=8,
+        remainder="keep",
+        cache_sliced=False,
+    )
+    expected = load_sliced(ResonatorPipeline(vid, filename="full.npy", **kwargs).run())
+
+    # crash after the second checkpoint is written
+    save = ResonatorPipeline._save_checkpoint
+    saves = []
+
+    def _crash(self, rows):
+        save(self, rows)
+        saves.append(len(rows))
+        if len(saves) == 2:
+            raise KeyboardInterrupt()
+
+    monkeypatch.setattr(ResonatorPipeline, "_save_checkpoint", _crash)
+    try:
+        ResonatorPipeline(vid, filename="resumed.npy", **kwargs).run()
+    except KeyboardInterrupt:
+        pass
+    monkeypatch.setattr(ResonatorPipeline, "_save_checkpoint", save)
+
+    rep = ResonatorPipeline(vid, filename="resumed.npy", **kwargs)
+    resumed = load_sliced(rep.run())
+    assert rep.resumed_from == saves[-1] * rep.slice_freq
+    np.testing.assert_array_equal(resumed, expected)
+
+    # the full cropped video isn't replaced by the part after the checkpoint
+    stem, ext = os.path.splitext(ENV.CROPPED_FILENAME)
+    partial = f"{rep.out_folder}{os.sep}{stem}_from_{rep.resumed_from}{ext}"
+    assert os.path.exists(partial)
+    assert os.listdir(f"{tmp_path}{os.sep}checkpoints") == []
+
+
+def test_sliced_cache_skips_video(synthetic_video, tmp_path, monkeypatch):
+    vid = synthetic_video()
+    kwargs = dict(
+        dims={"X": 5, "Y": 5, "W": 50, "H": 40},
+        basis_image="tests/data/test_basis.jpg",
+        cache_dir=str(tmp_path),
+    )
+    first = ResonatorPipeline(vid, filename="first.npy", **kwargs)
+    expected = load_sliced(first.run(None))
+
+    # a second run with the same inputs must not open the video
+    def _fail(*args):
+        raise AssertionError("video should not be read")
+
+    monkeypatch.setattr(ResonatorPipeline, "_capture", _fail)
+    second = ResonatorPipeline(vid, filename="second.csv", **kwargs)
+    np.testing.assert_array_equal(load_sliced(second.run(None)), expected)
+    assert second.fps == first.fps
+    assert (second.X, second.Y, second.W, second.H) == (
+        first.X,
+        first.Y,
+        first.W,
+        first.H,
+    )
@@ -0,0 +1,280 @@
+import json
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+import scipy.ndimage
+from src.api.compare import read_live_log
+from src.api.live import (
+    _get_brightness,
+    _get_config,
+    _preview,
+    _report_brightness,
+    _window_sum,
+    analyze_live_video,
+)
+from src.api.replay import ReplayCapture
+from src.api.sinks import FIELDS, CallbackSink, FileSink, SocketSink, StdoutSink
+from src.api.smoothing import CausalGaussian, divergence, live_sigma
+from src.core.resonator_pipeline import frame_to_slice
+from src.extra.queues import QueueWorker
+
+
+def test_causal_gaussian_matches_offline():
+    y = np.random.default_rng(0).normal(size=2000)
+    sigma = live_sigma(6, 5, 3)
+    offline = scipy.ndimage.gaussian_filter1d(y, sigma)
+
+    smoother = CausalGaussian(sigma)
+    live = np.array([smoother.update(v) for v in y])
+
+    # output lags by the radius, and is the same away from the edges
+    lag = smoother.lag
+    np.testing.assert_allclose(live[2 * lag :], offline[lag:-lag])
+
+    # less lag is still smoothed, and follows the offline series
+    short = CausalGaussian(sigma, lag=3)
+    live = np.array([short.update(v) for v in y])
+    assert live[100:].std() < y.std() / 2
+    stats = divergence((np.arange(2000) - 3, live), (np.arange(2000), offline))
+    assert stats["r"] > 0.5
+
+
+def test_window_sum_crop_first():
+    config = _get_config()
+    rng = np.random.default_rng(0)
+    frames = [rng.integers(0, 256, (1080, 1920, 3), dtype=np.uint8) for _ in range(4)]
+
+    # same as averaging whole frames, then cropping and slicing
+    mean = np.mean(np.stack(frames, axis=-1), axis=-1)
+    x, y, w, h = (int(config[k]) for k in ("X", "Y", "W", "H"))
+    _slice = frame_to_slice(mean[y : y + h, x : x + w])
+    expected = np.mean(_slice[int(config["WIN_TOP"]) : int(config["WIN_BOTTOM"])])
+
+    sums, sizes = zip(*(_window_sum(frame, config) for frame in frames))
+    assert np.isclose(sum(sums) / sum(sizes), expected)
+
+    # and for one frame, the brightness used to calibrate
+    _slice = frame_to_slice(frames[0][y : y + h, x : x + w])
+    expected = np.mean(_slice[int(config["WIN_TOP"]) : int(config["WIN_BOTTOM"])])
+    assert np.isclose(_get_brightness(frames[0], config), expected)
+
+
+def test_live_output_round_trip(tmp_path, capsys):
+    config = _get_config()
+    config["SMOOTH_LAG"] = 0.5
+    smoother = CausalGaussian(2.0)
+
+    sinks = [StdoutSink()]
+    for i in range(3):
+        _report_brightness(100.0, 1000, 1000, i, config, 0, smoother, sinks)
+    sinks[0].close()
+    out = capsys.readouterr().out
+
+    # cell_loss is the last field, so existing scripts still work
+    assert all(
+        line.split(", ")[-1].startswith("cell_loss=") for line in out.split("\n")[:-1]
+    )
+
+    path = f"{tmp_path}{os.sep}live.txt"
+    with open(path, "w") as fp:
+        fp.write("Smoothed values are 0.5s behind\n" + out)
+    live = read_live_log(path)
+    assert len(live["t"]) == 3
+    np.testing.assert_allclose(live["smooth_bri"], live["raw_bri"], atol=1e-3)
+    np.testing.assert_allclose(live["t_smooth"], live["t"] - 0.5, atol=1e-3)
+
+
+def test_sinks(tmp_path):
+    records = [dict.fromkeys(FIELDS, 1.5) for _ in range(50)]
+    for i, record in enumerate(records):
+        record["frame"] = i
+
+    # tcp listener that collects everything sent to it
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen(1)
+    received = []
+
+    def listen():
+        conn, _ = server.accept()
+        with conn:
+            while True:
+                data = conn.recv(65536)
+                if not data:
+                    return
+                received.append(data)
+
+    listener = threading.Thread(target=listen)
+    listener.start()
+
+    batches = []
+    sinks = [
+        FileSink(f"{tmp_path}{os.sep}live.ndjson"),
+        FileSink(f"{tmp_path}{os.sep}live.csv"),
+        SocketSink(f"tcp:127.0.0.1:{server.getsockname()[1]}"),
+        CallbackSink(batches.append, batch=8),
+    ]
+    for record in records:
+        for sink in sinks:
+            sink.emit(record)
+    for sink in sinks:
+        sink.close()
+    listener.join(5)
+    server.close()
+
+    with open(f"{tmp_path}{os.sep}live.ndjson") as fp:
+        assert [json.loads(line) for line in fp] == records
+    df = pd.read_csv(f"{tmp_path}{os.sep}live.csv")
+    assert list(df.columns) == list(FIELDS) and list(df.frame) == list(range(50))
+    lines = b"".join(received).decode().splitlines()
+    assert [json.loads(line) for line in lines] == records
+    assert sinks[2].stats()["failed"] == 0
+    assert max(len(b) for b in batches) <= 8
+    assert [r for b in batches for r in b] == records
+
+
+@pytest.mark.parametrize("policy", ["block", "newest", "oldest"])
+def test_queue_worker_policies(policy):
+    release, done = threading.Event(), []
+
+    def handler(item):
+        release.wait()
+        done.append(item)
+
+    worker = QueueWorker(handler, 4, policy)
+    if policy == "block":
+        threading.Timer(0.2, release.set).start()
+    for i in range(20):
+        worker.put(i)
+    release.set()
+    worker.close()
+
+    stats = worker.stats()
+    assert stats["max_depth"] <= 4
+    assert stats["processed"] == len(done) == 20 - stats["dropped"]
+    assert done == sorted(done)
+    if policy == "block":
+        assert done == list(range(20))
+    elif policy == "newest":
+        assert stats["dropped"] > 0 and done[:2] == [0, 1]
+    else:
+        assert stats["dropped"] > 0 and done[-1] == 19
+
+
+def _live_session(synthetic_video, tmp_path, stop):
+    """Run a headless session on a video file until stop() is called"""
+    video = synthetic_video(n_frames=60, name="live_vid.mp4")
+    records = []
+    threading.Timer(1.5, stop).start()
+    analyze_live_video(
+        video,
+        f"{tmp_path}{os.sep}live_out.mp4",
+        buffer=5,
+        debug=True,
+        sinks=[CallbackSink(records.extend)],
+        preview_fps=0,
+        stop_file=f"{tmp_path}{os.sep}stop",
+        dims={"X": 0, "Y": 0, "W": 100, "H": 100},
+    )
+    return records
+
+
+def test_headless_stop_file(synthetic_video, tmp_path):
+    stop_file = f"{tmp_path}{os.sep}stop"
+    open(stop_file, "w").close()  # left over, removed at the start
+
+    records = _live_session(
+        synthetic_video, tmp_path, lambda: open(stop_file, "w").close()
+    )
+    assert [r["frame"] for r in records] == list(range(4, 60, 5))
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="no SIGTERM to self on Windows")
+def test_headless_sigterm(synthetic_video, tmp_path):
+    records = _live_session(
+        synthetic_video, tmp_path, lambda: os.kill(os.getpid(), signal.SIGTERM)
+    )
+    assert len(records) == 12
+
+
+def test_preview_downscaled():
+    frame = np.zeros((1080, 1920, 3), dtype=np.uint8)
+    assert _preview(frame, 640).shape == (360, 640, 3)
+    assert _preview(frame, 0) is frame
+
+
+def _replay_session(video, tmp_path):
+    records = []
+    analyze_live_video(
+        video,
+        f"{tmp_path}{os.sep}replay_out.mp4",
+        buffer=5,
+        sinks=[CallbackSink(records.extend)],
+        preview_fps=0,
+        dims={"X": 0, "Y": 0, "W": 100, "H": 100},
+        record="none",
+        replay_speed=0,
+    )
+    return records
+
+
+def test_replay_ends_with_video(synthetic_video, tmp_path):
+    video = synthetic_video(n_frames=60, name="replay_vid.mp4")
+    records = _replay_session(video, tmp_path)
+
+    # times come from the video, so two replays give the same results
+    assert [r["frame"] for r in records] == list(range(4, 60, 5))
+    assert [r["t"] for r in records] == pytest.approx([f / 30 for f in range(4, 60, 5)])
+    # but time is still when the buffer was captured
+    assert all(abs(r["time"] - time.time()) < 60 for r in records)
+    again = _replay_session(video, tmp_path)
+    assert [r["raw_bri"] for r in again] == [r["raw_bri"] for r in records]
+
+
+def test_replay_speed(synthetic_video):
+    video = synthetic_video(n_frames=30, name="paced_vid.mp4")
+    cap = ReplayCapture(video, speed=2)
+    start = time.perf_counter()
+    while cap.read()[0]:
+        pass
+    cap.release()
+
+    # 30 frames at 30 fps, twice as fast as real time
+    assert time.perf_counter() - start >= 29 / 60
+    assert cap.frames == 30 and cap.finished
+    assert cap.clock() == pytest.approx(29 * 1000 / 30)
+
+
+@pytest.mark.parametrize("ext", ["ndjson", "csv"])
+def test_read_live_log_from_sink(tmp_path, ext):
+    records = [dict.fromkeys(FIELDS, 0.5 * i) for i in range(10)]
+    path = f"{tmp_path}{os.sep}live.{ext}"
+    sink = FileSink(path)
+    for record in records:
+        sink.emit(record)
+    sink.close()
+
+    live = read_live_log(path)
+    np.testing.assert_allclose(live["t_smooth"], [r["t_smooth"] for r in records])
+    np.testing.assert_allclose(live["cell_loss"], [r["cell_loss"] for r in records])
+
+
+def test_socket_sink_counts_failed():
+    # nothing is listening on the port, so every record fails
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    port = server.getsockname()[1]
+    server.close()
+
+    sink = SocketSink(f"tcp:127.0.0.1:{port}", timeout=0.2)
+    for i in range(5):
+        sink.emit(dict.fromkeys(FIELDS, i))
+    sink.close()
+    assert sink.stats()["failed"] == 5
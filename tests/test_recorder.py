@@ -0,0 +1,73 @@
+import os
+
+import cv2
+import numpy as np
+from src.api.recorder import Recorder, segment_path
+
+CONFIG = {"X": 10, "Y": 20, "W": 64, "H": 48}
+
+
+def _frames(n):
+    rng = np.random.default_rng(0)
+    return [rng.integers(0, 256, (360, 640, 3), dtype=np.uint8) for _ in range(n)]
+
+
+def _video(path):
+    cap = cv2.VideoCapture(path)
+    n, shape = 0, None
+    while True:
+        success, frame = cap.read()
+        if not success:
+            break
+        n, shape = n + 1, frame.shape
+    cap.release()
+    return n, shape
+
+
+def test_roi_segments(tmp_path):
+    path = f"{tmp_path}{os.sep}session.mp4"
+    recorder = Recorder(path, fps=10, mode="roi", segment_s=1.0, segment_mb=0)
+    for frame in _frames(25):
+        recorder.put(frame, CONFIG)
+    recorder.close()
+
+    assert recorder.stats()["segments"] == 3
+    assert recorder.stats()["processed"] + recorder.stats()["dropped"] == 25
+    counts = [_video(segment_path(path, i)) for i in range(3)]
+    assert [c[1] for c in counts] == [(48, 64, 3)] * 3
+    assert [c[0] for c in counts] == [10, 10, 5]
+    assert not os.path.exists(path)
+
+
+def test_downscaled_single_file(tmp_path):
+    path = f"{tmp_path}{os.sep}session.mp4"
+    recorder = Recorder(path, fps=10, mode="downscaled", height=180, segment_s=0)
+    for frame in _frames(12):
+        recorder.put(frame, CONFIG)
+    recorder.close()
+
+    assert _video(path) == (12, (180, 320, 3))
+    assert recorder.stats()["segments"] == 1
+
+
+def test_no_recording(tmp_path):
+    path = f"{tmp_path}{os.sep}session.mp4"
+    recorder = Recorder(path, fps=10, mode="none")
+    assert recorder.put(_frames(1)[0], CONFIG)
+    recorder.close()
+    assert not os.path.exists(path)
+
+
+def test_close_after_encoder_died(tmp_path, capsys):
+    path = f"{tmp_path}{os.sep}session.mp4"
+    recorder = Recorder(path, fps=10, mode="roi", maxsize=2)
+    recorder._process.kill()
+    recorder._process.join()
+
+    # the queue fills up as nothing takes the frames
+    for frame in _frames(5):
+        recorder.put(frame, CONFIG)
+    assert recorder.dropped > 0
+
+    recorder.close()
+    assert "Encoder process exited" in capsys.readouterr().err
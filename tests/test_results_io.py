@@ -0,0 +1,64 @@
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+from src.core.histogram_pipeline import HistogramPipeline
+from src.core.results_io import export_xlsx, load_results, results_path, save_results
+from src.core.sliced_io import save_sliced
+from src.extra.calibright import _read_data, gen_df
+
+SAMPLE = f"data{os.sep}calibrate{os.sep}sample_data"
+
+
+@pytest.mark.parametrize("fmt", ["xlsx", "csv", "parquet", "feather", "npz"])
+def test_results_roundtrip(tmp_path, fmt):
+    if fmt in ("parquet", "feather"):
+        pytest.importorskip("pyarrow")
+    df = pd.DataFrame(
+        {"Time (min) - imaging": np.arange(5) / 3, "Cell count (M cells/mL)": np.nan}
+    )
+    path = save_results(df, results_path(f"{tmp_path}{os.sep}results.xlsx", fmt))
+    assert path.endswith(f".{fmt}")
+    pd.testing.assert_frame_equal(load_results(path), df)
+
+    xlsx = export_xlsx(path)
+    pd.testing.assert_frame_equal(pd.read_excel(xlsx), df)
+
+
+def test_histogram_pipeline_formats(tmp_path):
+    sliced = np.random.default_rng(0).uniform(0, 255, (200, 30))
+    path = save_sliced(f"{tmp_path}{os.sep}sliced.npy", sliced)
+    data = {"cells": np.full((1, 2), np.nan), "sensor": np.full((1, 2), np.nan)}
+    data = {key: pd.DataFrame(value) for key, value in data.items()}
+
+    hist = HistogramPipeline(
+        path, data, out_folder=str(tmp_path), xlsxname="results_data.xlsx"
+    )
+    fast = HistogramPipeline(
+        path,
+        data,
+        out_folder=str(tmp_path),
+        xlsxname="results_data.xlsx",
+        results_format="npz",
+    )
+    assert fast.results == f"{tmp_path}{os.sep}results_data.npz"
+    pd.testing.assert_frame_equal(
+        load_results(fast.results), load_results(hist.results)
+    )
+
+
+def test_calibration_reads_fast_formats(tmp_path):
+    for f in sorted(os.listdir(SAMPLE))[:2]:
+        df = pd.read_excel(f"{SAMPLE}{os.sep}{f}")
+        save_results(df, results_path(f"{tmp_path}{os.sep}{f}", "csv"))
+    # an xlsx copy of the same results is not read twice
+    shutil.copy(f"{SAMPLE}{os.sep}{f}", tmp_path)
+
+    data = _read_data(Path(tmp_path))
+    assert sorted(data) == [Path(f).stem for f in sorted(os.listdir(SAMPLE))[:2]]
+
+    fit_df, _ = gen_df(Path(tmp_path))
+    assert len(fit_df) == sum(len(df) for df in data.values())
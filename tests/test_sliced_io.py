@@ -0,0 +1,27 @@
+import os
+
+import numpy as np
+from src.core.sliced_io import load_meta, load_sliced, save_sliced
+from src.run.utils import get_background
+
+
+def test_npy_and_csv_roundtrip(tmp_path):
+    sliced = np.random.default_rng(0).uniform(0, 255, (40, 30))
+    for name in ("sliced.npy", "sliced.csv"):
+        path = save_sliced(f"{tmp_path}{os.sep}{name}", sliced, {"fps": 30.0})
+        np.testing.assert_array_equal(load_sliced(path), sliced)
+        assert load_meta(path) == {"fps": 30.0}
+
+
+def test_get_background_uses_metadata(tmp_path):
+    sliced = np.random.default_rng(0).uniform(0, 255, (40, 30))
+    path = f"{tmp_path}{os.sep}concentration_sliced.npy"
+    save_sliced(path, sliced)
+    expected = sliced[:20, 0:25].mean()
+    assert np.isclose(get_background(path, 20, (0, 25)), expected)
+
+    # background stored in metadata is used instead of reading the data
+    meta = {"background": {"value": 1.5, "nframes": 20, "window": [0, 25]}}
+    save_sliced(path, sliced, meta)
+    assert get_background(path, 20, (0, 25)) == 1.5
+    assert np.isclose(get_background(path, 10, (0, 25)), sliced[:10, 0:25].mean())
@@ -1,6 +1,9 @@
 import os
 
+import numpy as np
+from src.core.sliced_io import load_meta, load_sliced, save_sliced
 from src.run.pipeline import total_video_splitter
+from src.run.splitting import total_sliced_splitter
 
 
 def test_total_video_splitter(cleaning, load_result_data):
@@ -10,3 +13,22 @@ def test_total_video_splitter(cleaning, load_result_data):
     total_video_splitter(data_dict)
     cleaning(f"tests{os.sep}data{os.sep}sample_output")
     return data_dict
+
+
+def test_total_sliced_splitter(load_result_data, tmp_path):
+    json_path = f"tests{os.sep}data{os.sep}sample_output{os.sep}result_total.json"
+    data_dict = load_result_data(json_path, _key="total")
+
+    # 2400 s of data at 30 fps, averaged every 5 frames -> 6 rows per s
+    sliced = np.arange(2400 * 6, dtype=float).reshape(-1, 1).repeat(30, axis=1)
+    path = save_sliced(
+        f"{tmp_path}{os.sep}total_sliced.npy", sliced, {"fps": 30.0, "slice_freq": 5}
+    )
+    targets = total_sliced_splitter(data_dict, path, "sliced.npy")
+
+    # concentration ends at 1985 s, washing starts at 2192 s
+    conc, wash = load_sliced(targets["concentration"]), load_sliced(targets["washing"])
+    assert len(conc) == 1985 * 6
+    assert wash[0, 0] == 2192 * 6
+    assert len(wash) == (2400 - 2192) * 6
+    assert load_meta(targets["washing"])["start_time"] == 2192